@@ -1,14 +1,52 @@
+import os
 import re
-import uuid
 import json
-import difflib
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import click
 from flask import Flask, request, jsonify, render_template, session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, func, insert
+
+import factors
+from cache import ResponseCache, make_cache_backend
+from carbon_logic import get_resolver
+from counters import TotalCounter
+from events import Broker, TooManySubscribers, event_stream, sse
+from export import filter_range, parse_export_args, stream_export
+from identity import UserDirectory
+from ingest import bulk_ingest
+from migrations import migrate
+from pagination import keyset_page, parse_page_args
+from recompute import recompute
+from rollups import ALL_CATEGORIES, EPOCH, add_to_rollups, backfill, parse_window_args, top_users
+from sqlite_profile import apply_sqlite_profile, sqlite_engine_options
+
+try:
+    import scoring
+except ImportError:  # numpy is optional; batch scoring falls back to compute_item
+    scoring = None
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "change-this"
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///carbon.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("CARBON_DATABASE_URI", "sqlite:///carbon.db")
+app.config["PARSE_BATCH_MAX"] = 200             # texts accepted per /api/parse/batch call
+app.config["PARSE_BATCH_POOL_THRESHOLD"] = 0    # 0 = never use the process pool
+app.config["PARSE_BATCH_WORKERS"] = None        # None = os.cpu_count()
+app.config["RESPONSE_CACHE_BACKEND"] = "memory"  # or "sqlite" to share across workers
+app.config["RESPONSE_CACHE_PATH"] = "response_cache.db"
+app.config["RESPONSE_CACHE_TTL"] = 5            # seconds; a user's entries also drop on save
+app.config["FACTORS_RELOAD_SECONDS"] = 5        # how often emission_factors.json is checked
+app.config["TOTAL_SHARDS"] = 0                  # shard rows per hot user (0 = off), see counters.py
+app.config["TOTAL_SHARDED_USERS"] = []          # hot user ids whose totals are sharded
+app.config["TOTAL_FOLD_SECONDS"] = 30           # how often shards are folded into user.total_co2
+app.config["USER_CACHE_MAX_ENTRIES"] = 100000   # known users kept in memory, see identity.py
+app.config["USER_CACHE_TTL"] = 30
+app.config["EVENTS_INTERVAL"] = 1.0             # live updates are coalesced to one message per stream per interval
+app.config["EVENTS_MAX_SUBSCRIBERS"] = 1000     # open /api/events streams per process; more get 503
+app.config["EVENTS_KEEPALIVE"] = 15
+app.config["EVENTS_BOARD_REFRESH"] = 60         # the live board also re-reads other workers' writes this often
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_engine_options(app.config)
 db = SQLAlchemy(app)
 
 # ------------------ MODELS ------------------
@@ -24,104 +62,149 @@ class CarbonLog(db.Model):
     raw_text = db.Column(db.String(400))
     parsed = db.Column(db.Text)
     co2 = db.Column(db.Float)
+    factor_version = db.Column(db.String(20))  # emission_factors.json version used for co2
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "raw_text": self.raw_text,
+            "parsed": json.loads(self.parsed or "[]"),
+            "co2": self.co2,
+            "factor_version": self.factor_version,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+# kept in sync with migrations.INDEXES
+db.Index("ix_carbon_log_user_created", CarbonLog.user_id, CarbonLog.created_at.desc(), CarbonLog.id.desc())
+db.Index("ix_carbon_log_user_id_desc", CarbonLog.user_id, CarbonLog.id.desc())
+
+class CarbonLogItem(db.Model):
+    # one row per parsed item of a CarbonLog, so items can be filtered and
+    # aggregated in SQL; CarbonLog.parsed keeps the full JSON for display
+    __table_args__ = (
+        db.Index("ix_carbon_log_item_user_activity", "user_id", "activity"),
+        db.Index("ix_carbon_log_item_user_created", "user_id", "created_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    log_id = db.Column(db.Integer, db.ForeignKey("carbon_log.id"), nullable=False, index=True)
+    user_id = db.Column(db.String(36), nullable=False)
+    activity = db.Column(db.String(50))
+    category = db.Column(db.String(20))
+    quantity = db.Column(db.Float)
+    unit = db.Column(db.String(20))
+    quantity_kg = db.Column(db.Float)
+    co2 = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class IngestKey(db.Model):
+    __table_args__ = (db.UniqueConstraint("user_id", "key"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(36), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    rows = db.Column(db.Integer)
+    co2 = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CarbonRollup(db.Model):
+    # per-user CO₂ per day/week/month/all-time and category; see rollups.py
+    __table_args__ = (
+        db.Index("ix_carbon_rollup_board", "period", "period_start", "category", db.text("co2 DESC")),
+    )
+    user_id = db.Column(db.String(36), primary_key=True)
+    period = db.Column(db.String(10), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    co2 = db.Column(db.Float, default=0)
+    saved = db.Column(db.Float, default=0)
+    emitted = db.Column(db.Float, default=0)
+    entries = db.Column(db.Integer, default=0)
+
+class UserTotalShard(db.Model):
+    # pending total_co2 deltas of hot users; see counters.py
+    user_id = db.Column(db.String(36), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    co2 = db.Column(db.Float, default=0)
+
 with app.app_context():
+    apply_sqlite_profile(app, db)
     db.create_all()
+    with db.engine.begin() as connection:
+        migrate(connection)
 
 # ------------------ EMISSIONS ------------------
-EMISSION_FACTORS = {
-    "car": 0.20,
-    "bus": 0.05,
-    "train": 0.03,
-    "cycle": 0,
-    "walk": 0,
-    "motorbike": 0.10,
-    "electricity": 0.82,
-    "beef": 27,
-    "chicken": 6.9,
-    "pork": 12,
-    "pizza": 6,
-    "burger": 7,
-    "vegetables": 2,
-    "milk": 1.3,
-    "egg": 4.8,
-}
-
-SERVING_WEIGHTS = {
-    "slice": 0.125,
-    "serving": 0.2,
-    "meal": 0.3,
-    "piece": 0.1,
-    "default": 0.2
-}
+# factor values and serving weights come from the shared registry (factors.py / emission_factors.json)
+SERVING_WEIGHTS = factors.SERVING_WEIGHTS
 
 GRAMS_TO_KG = 1/1000
 
+# parser vocabulary per unit-derived category
 TRANSPORT = ["car", "bus", "train", "cycle", "walk", "motorbike"]
 FOODS = ["beef", "chicken", "pizza", "burger", "vegetables"]
 ENERGY = ["electricity"]
+# everything a token may fuzzy-match to when the unit gives no category;
+# each must have a factor in emission_factors.json
+ACTIVITIES = TRANSPORT + ["electricity", "beef", "chicken", "pork", "pizza", "burger", "vegetables", "milk", "egg"]
 
 # ------------------ PARSING HELPERS ------------------
+UNITS = ["g", "gm", "kg", "km", "kwh", "slice", "serving", "meal", "piece"]
+UNIT_CATEGORY = {"km": "transport", "kwh": "energy", **{u: "food" for u in UNITS if u not in ("km", "kwh")}}
+
+# Clauses are split on whole-word "and", "," and ";" ("sandwich" stays whole).
+CLAUSE_SEP_RE = re.compile(r"\band\b|[,;]")
+
+# One scan over a clause yields (qty, unit, word) tuples, one field set each:
+#   qty   12, 3.5 or 1/2, with `unit` set when a unit follows it; like before,
+#         the unit may be the start of a longer word ("2 slices" -> slice)
+#   word  any run of letters (the unit's word is still emitted as a word)
+TOKEN_RE = re.compile(
+    r"(\d+(?:\.\d+)?(?:/\d+(?:\.\d+)?)?)(?=\s*(" + "|".join(UNITS) + r")?)"
+    r"|([a-z]+)"
+)
+
 def parse_number(token):
     token = token.lower().replace(",", "")
-    if "/" in token:
-        a,b = token.split("/")
-        return float(a)/float(b)
     try:
+        if "/" in token:
+            a,b = token.split("/")
+            return float(a)/float(b)
         return float(token)
-    except:
+    except (ValueError, ZeroDivisionError):
         return None
 
-def extract_qty_unit(text):
-    m = re.search(r"(\d+(\.\d+)?)(\s*)(g|gm|kg|km|kwh|slice|serving|meal|piece)?", text)
-    if not m:
-        return None, None
-    num = parse_number(m.group(1))
-    unit = m.group(4)
-    return num, unit
-
-def fuzzy(word, group=None):
-    word = word.lower()
-    if group:
-        choices = group
-    else:
-        choices = list(EMISSION_FACTORS.keys())
-    match = difflib.get_close_matches(word, choices, n=1, cutoff=0.6)
-    return match[0] if match else None
+# fuzzy matchers per unit-derived category (None = any activity), bound once
+RESOLVE = {
+    "transport": get_resolver(TRANSPORT).resolve,
+    "food": get_resolver(FOODS).resolve,
+    "energy": get_resolver(ENERGY).resolve,
+    None: get_resolver(ACTIVITIES).resolve,
+}
 
 def parse_text(text):
-    parts = re.split(r"and|,|;", text.lower())
     items = []
-    for p in parts:
+    for p in CLAUSE_SEP_RE.split(text.lower()):
         p = p.strip()
         if not p:
             continue
 
-        qty, unit = extract_qty_unit(p)
-        tokens = re.findall(r"[a-zA-Z]+", p)
-
-        # Decide category based on unit
-        category = None
-        if unit in ["km"]:
-            category = "transport"
-        elif unit in ["g","gm","kg","slice","serving","meal","piece"]:
-            category = "food"
-        elif unit == "kwh":
-            category = "energy"
-
+        # the first quantity of the clause (and the unit right after it)
+        tokens = TOKEN_RE.findall(p)
+        qty, unit = None, None
+        for number, unit_word, _ in tokens:
+            if number:
+                qty, unit = parse_number(number), unit_word or None
+                break
+        tokens = [word for _, _, word in tokens if word]
+
+        # Decide category based on unit; with one, only the first word is tried
+        category = UNIT_CATEGORY.get(unit)
         matched = None
-        for t in tokens:
-            if category == "transport":
-                matched = fuzzy(t, TRANSPORT); break
-            elif category == "food":
-                matched = fuzzy(t, FOODS); break
-            elif category == "energy":
-                matched = fuzzy(t, ENERGY); break
+        if category and tokens:
+            matched = RESOLVE[category](tokens[0])
 
         if not matched:
             for t in tokens:
-                matched = fuzzy(t)
+                matched = RESOLVE[None](t)
                 if matched: break
 
         if not matched:
@@ -153,19 +236,20 @@ def parse_text(text):
 
     return items
 
-def compute_item(item):
+def compute_item(item, table=None):
     act = item["activity"]
     qty = item["quantity"]
     unit = item["unit"]
     qkg = item["quantity_kg"]
+    emission_factors = (table or factors.current()).factors
 
     if unit == "km":
-        factor = EMISSION_FACTORS.get(act, 0.2)
+        factor = emission_factors.get(act, 0.2)
         co2 = - qty * factor
         return co2, f"{act} {qty} km → {co2:.2f} kg CO₂"
 
     if unit == "kwh":
-        factor = EMISSION_FACTORS["electricity"]
+        factor = emission_factors["electricity"]
         co2 = - qty * factor
         return co2, f"electricity {qty} kWh → {co2:.2f} kg CO₂"
 
@@ -173,39 +257,159 @@ def compute_item(item):
     if qkg is None:
         qkg = qty * SERVING_WEIGHTS["default"]
 
-    factor = EMISSION_FACTORS.get(act, 6)
+    factor = emission_factors.get(act, 6)
     co2 = - qkg * factor
     return co2, f"{act} {qkg:.2f} kg → {co2:.2f} kg CO₂"
 
+def score_logs(logs, table=None):
+    """
+    Scores the items of many logs in one batch (vectorized when numpy is
+    installed, see scoring.py): sets each item's co2 and explain in place
+    and returns the per-log totals, exactly as compute_item would.
+    """
+    table = table or factors.current()
+    items = [it for log in logs for it in log]
+    if scoring is None:
+        for it in items:
+            it["co2"], it["explain"] = compute_item(it, table)
+    else:
+        batch = scoring.get_engine(table).batch(items)
+        for it, co2, msg in zip(items, batch.values(), batch.explanations()):
+            it["co2"], it["explain"] = co2, msg
+
+    totals = []
+    for log in logs:
+        total = 0
+        for it in log:
+            total += it["co2"]
+        totals.append(total)
+    return totals
+
+def rescore_parsed(parsed_logs, table=None):
+    # the recompute job: CarbonLog.parsed strings in, (new parsed strings, log totals) out
+    logs = [json.loads(p or "[]") for p in parsed_logs]
+    totals = score_logs(logs, table)
+    return [json.dumps(log) for log in logs], totals
+
+def item_category(item):
+    # same split compute_item scores by
+    if item["unit"] == "km":
+        return "transport"
+    if item["unit"] == "kwh":
+        return "energy"
+    return "food"
+
+def log_item_rows(log_id, user_id, created_at, parsed):
+    # CarbonLogItem rows for one log's parsed JSON
+    return [
+        {
+            "log_id": log_id,
+            "user_id": user_id,
+            "activity": i["activity"],
+            "category": item_category(i),
+            "quantity": i["quantity"],
+            "unit": i["unit"],
+            "quantity_kg": i.get("quantity_kg"),
+            "co2": i["co2"],
+            "created_at": created_at
+        }
+        for i in json.loads(parsed or "[]")
+    ]
+
+def log_events(items):
+    # one (user_id, created_at, category, co2) rollup event per item row
+    return [(i["user_id"], i["created_at"], i["category"], i["co2"]) for i in items]
+
 def compute_all(text):
     parsed = parse_text(text)
+    table = factors.current()
     total = 0
     results = []
     for it in parsed:
-        co2, msg = compute_item(it)
+        co2, msg = compute_item(it, table)
         it["co2"] = co2
         it["explain"] = msg
         results.append(it)
         total += co2
     return results, total
 
+# ------------------ RUNNING TOTALS ------------------
+counter = TotalCounter(
+    db, User, CarbonLog, UserTotalShard,
+    shards=app.config["TOTAL_SHARDS"],
+    sharded_users=app.config["TOTAL_SHARDED_USERS"],
+    fold_seconds=app.config["TOTAL_FOLD_SECONDS"]
+)
+
 # ------------------ SESSION HANDLER ------------------
+user_directory = UserDirectory(
+    db, User, counter,
+    max_entries=app.config["USER_CACHE_MAX_ENTRIES"],
+    ttl=app.config["USER_CACHE_TTL"],
+    default_name=lambda uid: f"User-{uid[:6]}"
+)
+
 def get_user():
-    uid = session.get("uid")
-    if not uid:
-        uid = str(uuid.uuid4())
-        session["uid"] = uid
-        db.session.add(User(id=uid, name=f"User-{uid[:6]}"))
-        db.session.commit()
-    return User.query.get(uid)
+    # resolved from the session cookie without a query; the row is created on the first save
+    return user_directory.current("uid")
+
+# ------------------ RESPONSE CACHE ------------------
+responses = ResponseCache(make_cache_backend(app.config))
+
+def session_uid():
+    return session.get("uid")
+
+# ------------------ LIVE UPDATES ------------------
+broker = Broker(
+    interval=app.config["EVENTS_INTERVAL"],
+    max_subscribers=app.config["EVENTS_MAX_SUBSCRIBERS"],
+    logger=app.logger
+)
+
+def render_leaderboard():
+    # the all-time board; runs on the broker's flusher thread at most once per interval
+    with app.app_context():
+        return leaderboard_payload("all", EPOCH, ALL_CATEGORIES, 20, 0)
+
+broker.board("leaderboard", render_leaderboard, refresh_seconds=app.config["EVENTS_BOARD_REFRESH"])
+
+def publish_save(user_id, total, logs):
+    topic = f"user:{user_id}"
+    for log in logs:
+        broker.append(topic, "log", log)
+    broker.publish(topic, "total", {"total_co2": round(total, 4)})
+    broker.touch("leaderboard")
+
+def live_stream(topics, first_frames):
+    # subscribed before the snapshot is read, so nothing written in between is lost
+    try:
+        sub = broker.subscribe(topics)
+    except TooManySubscribers:
+        return jsonify({"ok": False, "error": "Too many live connections. Try again shortly."}), 503
+    try:
+        first = first_frames()
+    except Exception:
+        broker.unsubscribe(sub)
+        raise
+    return event_stream(broker, sub, first, app.config["EVENTS_KEEPALIVE"])
 
 # ------------------ ROUTES ------------------
 
+@app.before_request
+def refresh_factors():
+    # picks up edits to emission_factors.json without a restart
+    factors.reload_if_changed(app.config["FACTORS_RELOAD_SECONDS"])
+
+@app.before_request
+def fold_total_shards():
+    # no-op unless TOTAL_SHARDS is on
+    counter.fold_if_due()
+
 @app.route("/", methods=["GET"])
 def home():
     user = get_user()
-    logs = CarbonLog.query.filter_by(user_id=user.id).order_by(CarbonLog.id.desc()).all()
-    return render_template("index.html", user=user, logs=logs)
+    logs, next_cursor = keyset_page(CarbonLog.query.filter_by(user_id=user.id), CarbonLog)
+    return render_template("index.html", user=user, logs=logs, next_cursor=next_cursor)
 
 
 @app.route("/api/parse", methods=["POST"])
@@ -214,48 +418,292 @@ def api_parse():
     parsed, total = compute_all(text)
     return jsonify({"ok": True, "parsed": parsed, "total": total})
 
+_parse_pool = None
+
+def parse_pool():
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=app.config["PARSE_BATCH_WORKERS"])
+    return _parse_pool
+
+def compute_batch(texts):
+    threshold = app.config["PARSE_BATCH_POOL_THRESHOLD"]
+    if threshold and len(texts) >= threshold:
+        workers = app.config["PARSE_BATCH_WORKERS"] or os.cpu_count() or 1
+        chunksize = max(1, len(texts) // (4 * workers))
+        return list(parse_pool().map(compute_all, texts, chunksize=chunksize))
+    logs = [parse_text(t) for t in texts]
+    return list(zip(logs, score_logs(logs)))
+
+@app.route("/api/parse/batch", methods=["POST"])
+def api_parse_batch():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "body must be a JSON object"}), 400
+    texts = payload.get("texts")
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"ok": False, "error": "texts must be a list of strings"}), 400
+    if len(texts) > app.config["PARSE_BATCH_MAX"]:
+        return jsonify({"ok": False, "error": f"at most {app.config['PARSE_BATCH_MAX']} texts per batch"}), 413
+
+    items = []
+    grand_total = 0
+    for parsed, total in compute_batch(texts):
+        items.append({"ok": True, "parsed": parsed, "total": total})
+        grand_total += total
+    return jsonify({"ok": True, "count": len(items), "items": items, "total": grand_total})
+
+def score_entries(entries):
+    # Recompute CO₂ safely; entries are {"text", "parsed"} dicts from the client
+    table = factors.current()
+    logs = [
+        [
+            {
+                "activity": p["activity"],
+                "quantity": float(p["quantity"]),
+                "unit": p["unit"].lower(),
+                "quantity_kg": p.get("quantity_kg")
+            }
+            for p in e.get("parsed", [])
+        ]
+        for e in entries
+    ]
+    totals = score_logs(logs, table)
+    return [
+        {
+            "raw_text": e.get("text", ""),
+            "parsed": json.dumps(log),
+            "co2": total,
+            "factor_version": table.version
+        }
+        for e, log, total in zip(entries, logs, totals)
+    ]
+
+def add_items_and_rollups(rows):
+    # runs inside bulk_ingest's transaction, once the log rows have ids
+    items = [i for r in rows for i in log_item_rows(r["id"], r["user_id"], r["created_at"], r["parsed"])]
+    if items:
+        db.session.execute(insert(CarbonLogItem), items)
+    add_to_rollups(db, CarbonRollup, log_events(items))
+
+def idempotency_key(data):
+    return request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+
+def save_rows(user, rows, key):
+    saved = []
+
+    def derived_writes(inserted):
+        add_items_and_rollups(inserted)
+        saved.extend(inserted)
+
+    user_directory.ensure(user)
+    result = bulk_ingest(
+        db, CarbonLog, counter, user.id, rows, IngestKey, key, derived_writes,
+        ensure_user=lambda: user_directory.recreate(user)
+    )
+    if not result["replayed"]:
+        user_directory.written(user.id, result["total_co2"])
+        responses.invalidate_user(user.id)
+        publish_save(user.id, result["total_co2"], [CarbonLog(**r).to_dict() for r in saved])
+    return result
+
 @app.route("/api/save", methods=["POST"])
 def api_save():
     data = request.json
-    text = data.get("text","")
-    parsed = data.get("parsed",[])
+    save_rows(get_user(), score_entries([data]), idempotency_key(data))
+    return jsonify({"ok": True, "saved": True})
 
-    user = get_user()
+@app.route("/api/save/bulk", methods=["POST"])
+def api_save_bulk():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "body must be a JSON object"}), 400
+    entries = data.get("entries")
+    if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+        return jsonify({"ok": False, "error": "entries must be a list of objects"}), 400
 
-    # Recompute CO₂ safely
-    corrected_items = []
-    total = 0
-    for p in parsed:
-        item = {
-            "activity": p["activity"],
-            "quantity": float(p["quantity"]),
-            "unit": p["unit"].lower(),
-            "quantity_kg": p.get("quantity_kg")
-        }
-        co2, msg = compute_item(item)
-        item["co2"] = co2
-        item["explain"] = msg
-        corrected_items.append(item)
-        total += co2
+    result = save_rows(get_user(), score_entries(entries), idempotency_key(data))
+    return jsonify({"ok": True, **result})
 
-    log = CarbonLog(
-        user_id=user.id,
-        raw_text=text,
-        parsed=json.dumps(corrected_items),
-        co2=total
+@app.route("/api/logs")
+@responses.cached(scope="user", user_id=session_uid)
+def api_logs():
+    user = get_user()
+    try:
+        limit, before, after = parse_page_args(request.args)
+        logs, next_cursor = keyset_page(CarbonLog.query.filter_by(user_id=user.id), CarbonLog, limit, before, after)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"items": [l.to_dict() for l in logs], "next_cursor": next_cursor})
+
+@app.route("/api/export")
+def api_export():
+    user = get_user()
+    try:
+        fmt, since, until = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    query = filter_range(CarbonLog.query.filter_by(user_id=user.id), CarbonLog, since, until)
+    query = query.order_by(CarbonLog.created_at.asc(), CarbonLog.id.asc())
+    fields = ["id", "created_at", "raw_text", "co2", "parsed"]
+    return stream_export(query, fields, fmt, "carbon-logs", gzip="gzip" in request.accept_encodings)
+
+@app.route("/api/leaderboard")
+@responses.cached(scope="global")
+def api_leaderboard():
+    # ?window=day|week|month|all&category=transport|food|energy&date=YYYY-MM-DD
+    try:
+        period, start, category = parse_window_args(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    return jsonify(leaderboard_payload(period, start, category, limit, offset))
+
+def leaderboard_payload(period, start, category, limit, offset):
+    entries = top_users(db, CarbonRollup, period, start, category, limit, offset)
+    users = {u.id: u for u in User.query.filter(User.id.in_([uid for _, uid, _, _ in entries]))}
+    items = [
+        {"rank": rank, "id": uid, "name": users[uid].name if uid in users else None, "co2": co2, "entries": n}
+        for rank, uid, co2, n in entries
+    ]
+    return {"window": period, "period_start": start.isoformat(), "category": category, "items": items}
+
+@app.route("/api/leaderboard/stream")
+def api_leaderboard_stream():
+    # the all-time /api/leaderboard, pushed whenever it changes
+    return live_stream(["leaderboard"], lambda: [sse("leaderboard", broker.current("leaderboard"))])
+
+@app.route("/api/events")
+def api_events():
+    # "total" and "log" (new logs, newest last) as the session user saves; ?leaderboard=1 adds the board
+    user = get_user()
+    topics = [f"user:{user.id}"]
+    if request.args.get("leaderboard"):
+        topics.append("leaderboard")
+
+    def first_frames():
+        frames = [sse("total", {"total_co2": round(user.total_co2, 4)})]
+        if "leaderboard" in topics:
+            frames.append(sse("leaderboard", broker.current("leaderboard")))
+        return frames
+
+    return live_stream(topics, first_frames)
+
+def rebuild_rollups():
+    return backfill(
+        db, CarbonLog, CarbonRollup,
+        lambda l: log_events(log_item_rows(l.id, l.user_id, l.created_at or datetime.utcnow(), l.parsed))
     )
-    db.session.add(log)
 
-    user.total_co2 += total
-    db.session.commit()
-
-    return jsonify({"ok": True, "saved": True})
+@app.cli.command("backfill-rollups")
+def backfill_rollups_command():
+    """Rebuild carbon_rollup from carbon_log (run with writers stopped)."""
+    done = rebuild_rollups()
+    print(f"✅ rolled up {done} logs")
 
-@app.route("/api/logs")
-def api_logs():
+@app.route("/api/aggregates")
+@responses.cached(scope="user", user_id=session_uid)
+def api_aggregates():
+    # ?by=activity|category|unit, optional ?since=/?until= ISO dates; GROUP BY over CarbonLogItem
     user = get_user()
-    logs = CarbonLog.query.filter_by(user_id=user.id).all()
-    return jsonify([l.parsed for l in logs])
+    column = {"activity": CarbonLogItem.activity, "category": CarbonLogItem.category, "unit": CarbonLogItem.unit}.get(
+        request.args.get("by", "activity")
+    )
+    if column is None:
+        return jsonify({"ok": False, "error": "by must be activity, category or unit"}), 400
+    try:
+        _, since, until = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    query = filter_range(
+        db.session.query(
+            column.label("key"),
+            func.count(CarbonLogItem.id),
+            func.sum(CarbonLogItem.quantity_kg),
+            func.sum(CarbonLogItem.co2)
+        ).filter(CarbonLogItem.user_id == user.id),
+        CarbonLogItem, since, until
+    ).group_by(column).order_by(func.sum(CarbonLogItem.co2))
+    return jsonify([
+        {"key": key, "items": n, "quantity_kg": qkg, "co2": co2}
+        for key, n, qkg, co2 in query
+    ])
+
+@app.cli.command("backfill-log-items")
+def backfill_log_items_command():
+    """Create CarbonLogItem rows for logs saved before the table existed."""
+    last_id, done = 0, 0
+    while True:
+        batch = (
+            CarbonLog.query.filter(CarbonLog.id > last_id)
+            .filter(~db.session.query(CarbonLogItem.id).filter(CarbonLogItem.log_id == CarbonLog.id).exists())
+            .order_by(CarbonLog.id).limit(5000).all()
+        )
+        if not batch:
+            break
+        items = [
+            i for l in batch
+            for i in log_item_rows(l.id, l.user_id, l.created_at or datetime.utcnow(), l.parsed)
+        ]
+        if items:
+            db.session.execute(insert(CarbonLogItem), items)
+        db.session.commit()
+        last_id, done = batch[-1].id, done + len(batch)
+        db.session.expunge_all()
+        print(f"  split {done} logs (last id {last_id})")
+    print(f"✅ backfilled items for {done} logs")
+
+@app.cli.command("recompute")
+@click.option("--batch-size", default=2000, show_default=True)
+@click.option("--checkpoint", default="recompute-carbon_log.json", show_default=True)
+@click.option("--all", "everything", is_flag=True, help="Also re-score rows already on the current factor version.")
+def recompute_command(batch_size, checkpoint, everything):
+    """Re-score carbon_log with the current emission factors (run with writers stopped)."""
+    table = factors.reload()
+
+    def score_batch(rows):
+        parsed, totals = rescore_parsed([r.parsed for r in rows], table)
+        return [
+            {"id": r.id, "parsed": p, "co2": total, "factor_version": table.version}
+            for r, p, total in zip(rows, parsed, totals)
+        ]
+
+    def replace_items(rows, updates):
+        # CarbonLogItem copies the per-item co2, so rewrite the batch's item rows
+        db.session.execute(delete(CarbonLogItem).where(CarbonLogItem.log_id.in_([r.id for r in rows])))
+        items = [
+            i for r, u in zip(rows, updates)
+            for i in log_item_rows(r.id, r.user_id, r.created_at or datetime.utcnow(), u["parsed"])
+        ]
+        if items:
+            db.session.execute(insert(CarbonLogItem), items)
+
+    print(f"re-scoring carbon_log with factors {table.version}")
+    result = recompute(
+        db, CarbonLog, User, ["user_id", "created_at", "parsed"], score_batch, table.version,
+        batch_size=batch_size, checkpoint=checkpoint, everything=everything, after_batch=replace_items,
+        rebuild=counter.rebuild
+    )
+    rebuild_rollups()
+    print(f"✅ re-scored {result['rows']} logs in {result['seconds']:.1f}s ({result['rows_per_sec']:.0f} rows/s)")
+
+@app.cli.command("reconcile-totals")
+@click.option("--fix", is_flag=True, help="Rebuild user.total_co2 from the logs when they disagree.")
+def reconcile_totals_command(fix):
+    """Check user.total_co2 (plus sharded counters) against SUM(co2) of carbon_log."""
+    counter.fold()
+    drifted = counter.reconcile(fix=fix)
+    for uid, stored, actual in drifted[:20]:
+        print(f"❌ {uid}: total_co2 {stored:.6f}, logs sum to {actual:.6f}")
+    if not drifted:
+        print("✅ every total matches its logs")
+    elif fix:
+        print(f"✅ rebuilt totals ({len(drifted)} users had drifted)")
+    else:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     app.run(debug=True)
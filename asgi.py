@@ -0,0 +1,775 @@
+"""
+ASGI serving mode: Starlette handlers on SQLAlchemy's asyncio engine
+(aiosqlite), for high-concurrency dashboards that mostly wait on SQLite.
+
+    uvicorn asgi:app --workers 4
+
+It answers the same JSON contract as the WSGI apps:
+
+    server.py   POST /chat, /chat/bulk
+                GET  /history, /stats, /leaderboard (incl. ?window=), /leaderboard/me
+                GET  /events, /leaderboard/stream (Server-Sent Events)
+    app.py      POST /api/parse, /api/parse/batch, /api/save, /api/save/bulk
+                GET  /api/logs, /api/leaderboard
+                GET  /api/events, /api/leaderboard/stream
+
+Handlers are coroutines and every query goes through the async engine,
+so a request waiting on a commit does not hold a thread. Parsing and
+scoring are CPU-bound and run on a bounded thread pool (ASGI_PARSE_WORKERS
+threads); once ASGI_PARSE_QUEUE jobs are in flight new requests get 503.
+
+server.py and app.py are imported for their tables, config, rate limiter,
+user directories and pure helpers; they create/migrate the schema but do
+not serve anything here. Session cookies are signed the way each app
+signs them (server.py's SECRET_KEY for its routes, app.py's for /api), so
+cookies issued by either WSGI app keep their user ids here; /api routes
+keep theirs under "uid" as app.py does. Event streams use the apps' brokers (see
+events.py); an open stream here costs a coroutine, not a thread. /export, /api/export, /api/aggregates,
+/stats/summary, write-behind and the response cache stay WSGI-only.
+"""
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import functools
+import contextlib
+from datetime import datetime
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import BadSignature
+from sqlalchemy import and_, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+import app as api_app
+import factors
+import server
+from events import KEEPALIVE, TooManySubscribers, sse
+from identity import NO_ROW, Known, profile_written, read_profile, write_profile
+from pagination import keyset_query, page_of, parse_page_args
+from ratelimit import retry_after_seconds
+from rollups import board_query, parse_window_args, ranked, rollup_rows, rollup_upsert
+from sqlite_profile import install_pragmas, sqlite_engine_options
+
+PARSE_WORKERS = int(os.environ.get("ASGI_PARSE_WORKERS", 4))
+PARSE_QUEUE = int(os.environ.get("ASGI_PARSE_QUEUE", 256))
+
+
+# ---------------------------
+# Database
+# ---------------------------
+def async_engine():
+    # the same file as the WSGI apps, through aiosqlite, with the same pragmas
+    with server.app.app_context():
+        url = server.db.engine.url.set(drivername="sqlite+aiosqlite")
+    engine = create_async_engine(url, **sqlite_engine_options(server.app.config))
+    install_pragmas(engine.sync_engine, server.app.config)
+    return engine
+
+
+engine = async_engine()
+
+USERS = server.User.__table__
+LOGS = server.CarbonLog.__table__
+ROLLUPS = server.CO2Rollup.__table__
+API_USERS = api_app.User.__table__
+API_LOGS = api_app.CarbonLog.__table__
+API_ITEMS = api_app.CarbonLogItem.__table__
+API_KEYS = api_app.IngestKey.__table__
+API_ROLLUPS = api_app.CarbonRollup.__table__
+
+
+# ---------------------------
+# Parsing offload
+# ---------------------------
+class Busy(Exception):
+    pass
+
+
+parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+parse_slots = asyncio.Semaphore(PARSE_QUEUE)
+
+
+async def offload(fn, *args):
+    """Run fn(*args) on the parse pool; raises Busy when the pool's queue is full."""
+    if parse_slots.locked():
+        raise Busy()
+    async with parse_slots:
+        return await asyncio.get_running_loop().run_in_executor(parse_executor, fn, *args)
+
+
+# ---------------------------
+# Sessions and users
+# ---------------------------
+class Session:
+    """
+    A Flask app's signed session cookie, read and written without Flask:
+    server.py's (its SECRET_KEY and cookie settings) for server.py's
+    routes, app.py's for the /api routes. Here both route sets share one
+    cookie, so a cookie signed by the other app is accepted as well and
+    re-signed by this one on the next write.
+    """
+
+    def __init__(self, request, flask_app):
+        self.app = flask_app
+        self.interface = flask_app.session_interface
+        self.cookie = flask_app.config["SESSION_COOKIE_NAME"]
+        self.data, self.modified = {}, False
+        value = request.cookies.get(self.cookie)
+        if value:
+            for serializer in self.serializers(flask_app):
+                try:
+                    self.data = serializer.loads(value, max_age=self.max_age(flask_app))
+                    break
+                except BadSignature:
+                    continue
+
+    @staticmethod
+    def serializers(flask_app):
+        # this app's own signer first
+        others = [a for a in (server.app, api_app.app) if a is not flask_app]
+        return [a.session_interface.get_signing_serializer(a) for a in [flask_app] + others]
+
+    @staticmethod
+    def max_age(flask_app):
+        return int(flask_app.permanent_session_lifetime.total_seconds())
+
+    def user(self, key):
+        # identity.UserDirectory.current() without flask.g / flask.session
+        user_id, is_new = self.data.get(key), False
+        if not user_id:
+            user_id, is_new = str(uuid.uuid4()), True
+            self.data[key] = user_id
+            self.data[f"{key}_created"] = datetime.utcnow().isoformat()
+            self.modified = True
+        created = self.data.get(f"{key}_created")
+        return SimpleNamespace(
+            id=user_id,
+            is_new=is_new,
+            created_at=datetime.fromisoformat(created) if created else None,
+            session=self,
+            key=key,
+        )
+
+    def save(self, response):
+        if self.modified:
+            app, interface = self.app, self.interface
+            response.set_cookie(
+                self.cookie,
+                interface.get_signing_serializer(app).dumps(self.data),
+                path=interface.get_cookie_path(app),
+                domain=interface.get_cookie_domain(app),
+                secure=interface.get_cookie_secure(app),
+                httponly=interface.get_cookie_httponly(app),
+                samesite=interface.get_cookie_samesite(app),  # Flask's default: no SameSite attribute
+            )
+
+
+async def lookup(directory, conn, user):
+    """identity.UserDirectory.resolve() over the async engine, sharing its cache and cookie profile."""
+    if user.is_new:
+        return None
+    known = directory.cache.get(user.id)
+    if known is None:
+        known = read_profile(user.session.data, user.key, directory.cache.ttl)
+    if known is None:
+        users = directory.users
+        row = (
+            await conn.execute(
+                select(users.c.name, users.c.created_at, users.c.total_co2).where(users.c.id == user.id)
+            )
+        ).first()
+        if row is None:
+            known = NO_ROW
+        else:
+            total = row.total_co2 or 0.0
+            if directory.counter is not None and directory.counter.is_sharded(user.id):
+                total = await conn.scalar(directory.counter.total_query(user.id))
+            known = Known(row.name, row.created_at, float(total))
+        directory.cache.set(user.id, known)
+        write_profile(user.session.data, user.key, known)
+        user.session.modified = True
+    return None if known is NO_ROW else known
+
+
+async def add_user_total(directory, conn, user, delta):
+    """add_total() for a session user, as server.py's /chat: a stale cached profile gets the row recreated."""
+    total = await add_total(directory.counter, conn, user.id, delta)
+    if total is None:
+        directory.forget(user.id)
+        user.session.data.pop(f"{user.key}_profile", None)
+        user.session.modified = True
+        await conn.execute(directory.insert_missing(), directory.new_rows([(user.id, user.created_at)]))
+        total = await add_total(directory.counter, conn, user.id, delta)
+    return total
+
+
+def written(directory, user, total_co2):
+    # UserDirectory.written(), keeping this session's cookie profile in step
+    directory.written(user.id, total_co2)
+    profile_written(user.session.data, user.key, total_co2)
+    user.session.modified = True
+
+
+async def ensure(directory, conn, user):
+    # lazy row creation, as UserDirectory.ensure()
+    if await lookup(directory, conn, user) is None:
+        await conn.execute(directory.insert_missing(), directory.new_rows([(user.id, user.created_at)]))
+
+
+async def add_total(counter, conn, user_id, delta):
+    """counters.TotalCounter.add() over the async engine."""
+    if counter.is_sharded(user_id):
+        await conn.execute(counter.shard_upsert(), counter.shard_rows([(user_id, delta)]))
+        total = await conn.scalar(counter.total_query(user_id))
+    else:
+        total = await conn.scalar(
+            counter.increment.returning(counter.users.c.total_co2), {"uid": user_id, "delta": delta}
+        )
+    return None if total is None else float(total)
+
+
+# ---------------------------
+# Responses
+# ---------------------------
+def json_response(request, payload, status=200, etag=False, private=True):
+    # byte-for-byte what Flask's jsonify sends; read endpoints also get an ETag
+    body = (json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n").encode()
+    response = Response(body, status_code=status, media_type="application/json")
+    if etag and status == 200:
+        tag = hashlib.sha1(body).hexdigest()
+        if f'"{tag}"' in request.headers.get("if-none-match", ""):
+            response = Response(status_code=304)
+        response.headers["ETag"] = f'"{tag}"'
+        response.headers["Cache-Control"] = "private, no-cache" if private else "no-cache"
+    return response
+
+
+def error(request, message, status):
+    return json_response(request, {"ok": False, "error": message}, status)
+
+
+async def json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def endpoint(handler):
+    """Starlette endpoint from handler(request, session) -> response."""
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        factors.reload_if_changed(server.app.config["FACTORS_RELOAD_SECONDS"])
+        # the /api routes are app.py's and use its cookie signing, as under WSGI
+        session = Session(request, api_app.app if request.url.path.startswith("/api/") else server.app)
+        try:
+            response = await handler(request, session)
+        except Busy:
+            response = error(request, "Server busy. Try again shortly.", 503)
+            response.headers["Retry-After"] = "1"
+        session.save(response)
+        return response
+
+    return wrapper
+
+
+def rate_limited(request, name):
+    """The 429 response when the client is over `name`'s limit, else None."""
+    wait = server.limiter.check(name, request.client.host if request.client else "unknown")
+    if wait <= 0:
+        return None
+    seconds = retry_after_seconds(wait)
+    response = error(request, f"Too many requests. Try again in {seconds}s.", 429)
+    response.headers["Retry-After"] = str(seconds)
+    return response
+
+
+# ---------------------------
+# server.py contract
+# ---------------------------
+@endpoint
+async def chat(request, session):
+    limited = rate_limited(request, "chat")
+    if limited:
+        return limited
+    data = await json_body(request) or {}
+    prompt = (data.get("prompt") or "").strip()
+    if not prompt:
+        return error(request, "Empty prompt", 400)
+
+    calc = await offload(server.calculate_carbon_structured, prompt)
+    user = session.user("user_id")
+    row = {
+        "user_id": user.id,
+        "activity": prompt,
+        "category": calc["category"],
+        "quantity": calc["quantity"],
+        "unit": calc["unit"],
+        "co2": calc["co2"],
+        "factor_version": calc["factor_version"],
+        "created_at": datetime.utcnow(),
+    }
+    async with engine.begin() as conn:
+        await ensure(server.user_directory, conn, user)
+        row["id"] = await conn.scalar(insert(LOGS).returning(LOGS.c.id), row)
+        await conn.execute(rollup_upsert(ROLLUPS), rollup_rows(server.log_events([row])))
+        total = await add_user_total(server.user_directory, conn, user, calc["co2"])
+    written(server.user_directory, user, total)
+    server.leaderboard_index.set_total(user.id, total)
+    log = server.CarbonLog.to_dict(SimpleNamespace(**row))
+    server.publish_write(user.id, total, [log])
+
+    return json_response(
+        request,
+        {"ok": True, "message": calc["message"], "co2": calc["co2"], "total_co2": round(total, 6), "log": log},
+    )
+
+
+@endpoint
+async def chat_bulk(request, session):
+    limited = rate_limited(request, "chat_bulk")
+    if limited:
+        return limited
+    data = await json_body(request) or {}
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+        return error(request, "prompts must be a list of strings", 400)
+    prompts = [p.strip() for p in prompts if p.strip()]
+
+    user = session.user("user_id")
+    calcs = await offload(server.calculate_many, prompts)
+    rows = [
+        {
+            "activity": prompt,
+            "category": calc["category"],
+            "quantity": calc["quantity"],
+            "unit": calc["unit"],
+            "co2": calc["co2"],
+            "factor_version": calc["factor_version"],
+        }
+        for prompt, calc in zip(prompts, calcs)
+    ]
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    saved = []
+
+    async def derived_writes(conn, inserted):
+        await conn.execute(rollup_upsert(ROLLUPS), rollup_rows(server.log_events(inserted)))
+        saved.extend(inserted)
+
+    result = await bulk_ingest(
+        server.user_directory, server.counter, LOGS, server.IngestKey.__table__, user, rows, key, derived_writes
+    )
+    if not result["replayed"]:
+        server.leaderboard_index.set_total(user.id, result["total_co2"])
+        server.publish_write(user.id, result["total_co2"], [server.CarbonLog(**r).to_dict() for r in saved])
+    return json_response(
+        request,
+        {
+            "ok": True,
+            **result,
+            "results": [{"message": c["message"], "co2": c["co2"]} for c in calcs],
+            "total_co2": round(result["total_co2"], 6),
+        },
+    )
+
+
+@endpoint
+async def history(request, session):
+    user = session.user("user_id")
+    try:
+        limit, before, after = parse_page_args(request.query_params)
+        query = keyset_query(select(LOGS).where(LOGS.c.user_id == user.id), LOGS.c, limit, before, after)
+    except ValueError as e:
+        return error(request, str(e), 400)
+    async with engine.connect() as conn:
+        logs, next_cursor = page_of((await conn.execute(query)).all(), limit, after)
+    return json_response(
+        request, {"items": [server.CarbonLog.to_dict(l) for l in logs], "next_cursor": next_cursor}, etag=True
+    )
+
+
+async def stats_payload(conn, user):
+    known = await lookup(server.user_directory, conn, user)
+    return server.user_payload(
+        SimpleNamespace(
+            id=user.id,
+            name=known.name if known else None,
+            created_at=(known.created_at if known else None) or user.created_at,
+            total_co2=known.total_co2 if known else 0.0,
+        )
+    )
+
+
+@endpoint
+async def stats(request, session):
+    user = session.user("user_id")
+    async with engine.connect() as conn:
+        payload = await stats_payload(conn, user)
+    return json_response(request, payload, etag=True)
+
+
+def ranked_users(rows, first_rank=1):
+    # server.ranked_users() for rows of the users table
+    return [
+        {**server.User.to_dict(r), "total_co2": round(r.total_co2 or 0.0, 4), "rank": first_rank + i}
+        for i, r in enumerate(rows)
+    ]
+
+
+@endpoint
+async def leaderboard(request, session):
+    if "window" in request.query_params or "category" in request.query_params:
+        return await window_leaderboard(request)
+    # the same order as the in-memory index: highest total first, then id
+    query = select(USERS).order_by(USERS.c.total_co2.desc(), USERS.c.id.asc()).limit(20)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(query)).all()
+    return json_response(request, ranked_users(rows), etag=True, private=False)
+
+
+async def window_leaderboard(request):
+    try:
+        period, start, category = parse_window_args(request.query_params)
+        limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+        offset = max(0, int(request.query_params.get("offset", 0)))
+    except ValueError as e:
+        return error(request, str(e), 400)
+    async with engine.connect() as conn:
+        entries = ranked((await conn.execute(board_query(ROLLUPS.c, period, start, category, limit, offset))).all(), offset)
+        ids = [uid for _, uid, _, _ in entries]
+        users = {u.id: u for u in (await conn.execute(select(USERS).where(USERS.c.id.in_(ids)))).all()}
+    items = [
+        {**server.User.to_dict(users[uid]), "rank": rank, "co2": round(co2, 4), "entries": n}
+        for rank, uid, co2, n in entries
+        if uid in users
+    ]
+    payload = {"window": period, "period_start": start.isoformat(), "category": category, "items": items}
+    return json_response(request, payload, etag=True, private=False)
+
+
+@endpoint
+async def leaderboard_me(request, session):
+    user = session.user("user_id")
+    try:
+        radius = max(0, min(int(request.query_params.get("radius", 5)), 50))
+    except ValueError:
+        radius = 5
+    total = func.coalesce(USERS.c.total_co2, 0.0)
+    async with engine.connect() as conn:
+        known = await lookup(server.user_directory, conn, user)
+        total_users = await conn.scalar(select(func.count()).select_from(USERS))
+        if known is None:
+            return json_response(request, {"rank": None, "total_users": total_users, "around": []}, etag=True)
+        # rank = users ahead of this one in (total DESC, id ASC) order + 1
+        mine = await conn.scalar(select(total).where(USERS.c.id == user.id))
+        ahead = or_(total > mine, and_(total == mine, USERS.c.id < user.id))
+        behind = or_(total < mine, and_(total == mine, USERS.c.id > user.id))
+        rank = await conn.scalar(select(func.count()).select_from(USERS).where(ahead)) + 1
+        above = (
+            await conn.execute(select(USERS).where(ahead).order_by(total.asc(), USERS.c.id.desc()).limit(radius))
+        ).all()
+        me = (await conn.execute(select(USERS).where(USERS.c.id == user.id))).all()
+        below = (
+            await conn.execute(select(USERS).where(behind).order_by(total.desc(), USERS.c.id.asc()).limit(radius))
+        ).all()
+    around = ranked_users(list(reversed(above)) + me + below, rank - len(above))
+    return json_response(request, {"rank": rank, "total_users": total_users, "around": around}, etag=True)
+
+
+# ---------------------------
+# app.py contract (/api/*)
+# ---------------------------
+async def bulk_ingest(directory, counter, log_table, key_table, user, rows, idempotency_key, before_commit):
+    """
+    ingest.bulk_ingest() over the async engine: one transaction that creates
+    the user if needed, inserts the rows, bumps the total and records the
+    idempotency key. `before_commit(conn, rows)` returns an awaitable.
+    """
+
+    async def replay(conn):
+        seen = (
+            await conn.execute(
+                select(key_table.c.rows, key_table.c.co2).where(
+                    key_table.c.user_id == user.id, key_table.c.key == idempotency_key
+                )
+            )
+        ).first()
+        if seen is None:
+            return None
+        total = await conn.scalar(counter.total_query(user.id))
+        return {"inserted": seen.rows, "total": seen.co2, "replayed": True, "total_co2": float(total or 0.0)}
+
+    if idempotency_key:
+        async with engine.connect() as conn:
+            previous = await replay(conn)
+        if previous:
+            return previous
+
+    now = datetime.utcnow()
+    rows = [{"created_at": now, **r, "user_id": user.id} for r in rows]
+    total = sum(r["co2"] for r in rows)
+    try:
+        async with engine.begin() as conn:
+            await ensure(directory, conn, user)
+            if rows:
+                ids = (
+                    await conn.execute(insert(log_table).returning(log_table.c.id, sort_by_parameter_order=True), rows)
+                ).scalars()
+                for row, row_id in zip(rows, ids):
+                    row["id"] = row_id
+            total_co2 = await add_user_total(directory, conn, user, total)
+            await before_commit(conn, rows)
+            if idempotency_key:
+                await conn.execute(
+                    insert(key_table),
+                    {"user_id": user.id, "key": idempotency_key, "rows": len(rows), "co2": total, "created_at": now},
+                )
+    except IntegrityError:
+        # a concurrent retry with the same key won the race
+        async with engine.connect() as conn:
+            previous = await replay(conn) if idempotency_key else None
+        if previous is None:
+            raise
+        return previous
+
+    written(directory, user, total_co2)
+    return {"inserted": len(rows), "total": total, "replayed": False, "total_co2": total_co2}
+
+
+async def add_items_and_rollups(conn, rows):
+    # app.add_items_and_rollups() on an async connection
+    items = [i for r in rows for i in api_app.log_item_rows(r["id"], r["user_id"], r["created_at"], r["parsed"])]
+    if items:
+        await conn.execute(insert(API_ITEMS), items)
+    events = rollup_rows(api_app.log_events(items))
+    if events:
+        await conn.execute(rollup_upsert(API_ROLLUPS), events)
+
+
+async def save_entries(request, session, entries, key):
+    user = session.user("uid")
+    rows = await offload(api_app.score_entries, entries)
+    saved = []
+
+    async def derived_writes(conn, inserted):
+        await add_items_and_rollups(conn, inserted)
+        saved.extend(inserted)
+
+    result = await bulk_ingest(
+        api_app.user_directory, api_app.counter, API_LOGS, API_KEYS, user, rows, key, derived_writes
+    )
+    if not result["replayed"]:
+        api_app.publish_save(user.id, result["total_co2"], [api_app.CarbonLog(**r).to_dict() for r in saved])
+    return result
+
+
+@endpoint
+async def api_parse(request, session):
+    data = await json_body(request) or {}
+    parsed, total = await offload(api_app.compute_all, data.get("text", ""))
+    return json_response(request, {"ok": True, "parsed": parsed, "total": total})
+
+
+@endpoint
+async def api_parse_batch(request, session):
+    texts = (await json_body(request) or {}).get("texts")
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return error(request, "texts must be a list of strings", 400)
+    limit = api_app.app.config["PARSE_BATCH_MAX"]
+    if len(texts) > limit:
+        return error(request, f"at most {limit} texts per batch", 413)
+
+    items, grand_total = [], 0
+    for parsed, total in await offload(api_app.compute_batch, texts):
+        items.append({"ok": True, "parsed": parsed, "total": total})
+        grand_total += total
+    return json_response(request, {"ok": True, "count": len(items), "items": items, "total": grand_total})
+
+
+def idempotency_key(request, data):
+    return request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+
+
+@endpoint
+async def api_save(request, session):
+    data = await json_body(request) or {}
+    await save_entries(request, session, [data], idempotency_key(request, data))
+    return json_response(request, {"ok": True, "saved": True})
+
+
+@endpoint
+async def api_save_bulk(request, session):
+    data = await json_body(request) or {}
+    entries = data.get("entries")
+    if not isinstance(entries, list):
+        return error(request, "entries must be a list", 400)
+    result = await save_entries(request, session, entries, idempotency_key(request, data))
+    return json_response(request, {"ok": True, **result})
+
+
+@endpoint
+async def api_logs(request, session):
+    user = session.user("uid")
+    try:
+        limit, before, after = parse_page_args(request.query_params)
+        query = keyset_query(select(API_LOGS).where(API_LOGS.c.user_id == user.id), API_LOGS.c, limit, before, after)
+    except ValueError as e:
+        return error(request, str(e), 400)
+    async with engine.connect() as conn:
+        logs, next_cursor = page_of((await conn.execute(query)).all(), limit, after)
+    payload = {"items": [api_app.CarbonLog.to_dict(l) for l in logs], "next_cursor": next_cursor}
+    return json_response(request, payload, etag=True)
+
+
+@endpoint
+async def api_leaderboard(request, session):
+    try:
+        period, start, category = parse_window_args(request.query_params)
+        limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+        offset = max(0, int(request.query_params.get("offset", 0)))
+    except ValueError as e:
+        return error(request, str(e), 400)
+    async with engine.connect() as conn:
+        query = board_query(API_ROLLUPS.c, period, start, category, limit, offset)
+        entries = ranked((await conn.execute(query)).all(), offset)
+        ids = [uid for _, uid, _, _ in entries]
+        names = dict((await conn.execute(select(API_USERS.c.id, API_USERS.c.name).where(API_USERS.c.id.in_(ids)))).all())
+    items = [
+        {"rank": rank, "id": uid, "name": names.get(uid), "co2": co2, "entries": n}
+        for rank, uid, co2, n in entries
+    ]
+    payload = {"window": period, "period_start": start.isoformat(), "category": category, "items": items}
+    return json_response(request, payload, etag=True, private=False)
+
+
+# ---------------------------
+# Live updates (Server-Sent Events)
+# ---------------------------
+async def live_stream(request, broker, topics, first_frames):
+    """events.event_stream() for Starlette; first_frames() is awaited after subscribing."""
+    try:
+        sub = broker.subscribe(topics, loop=asyncio.get_running_loop())
+    except TooManySubscribers:
+        return error(request, "Too many live connections. Try again shortly.", 503)
+    try:
+        first = await first_frames()
+    except BaseException:
+        broker.unsubscribe(sub)
+        raise
+    keepalive = server.app.config["EVENTS_KEEPALIVE"]
+
+    async def generate():
+        try:
+            yield b"retry: 5000\n\n" + b"".join(first)
+            while True:
+                yield await sub.aget(keepalive) or KEEPALIVE
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def board_frame(broker):
+    # rendering is a blocking ORM query when the board is stale
+    data = await asyncio.get_running_loop().run_in_executor(None, broker.current, "leaderboard")
+    return sse("leaderboard", data)
+
+
+@endpoint
+async def events(request, session):
+    user = session.user("user_id")
+    topics = [f"user:{user.id}"]
+    if request.query_params.get("leaderboard"):
+        topics.append("leaderboard")
+
+    async def first_frames():
+        query = keyset_query(select(LOGS).where(LOGS.c.user_id == user.id), LOGS.c, 20)
+        async with engine.connect() as conn:
+            payload = await stats_payload(conn, user)
+            logs, next_cursor = page_of((await conn.execute(query)).all(), 20)
+        frames = [
+            sse("stats", payload),
+            sse("history", {"items": [server.CarbonLog.to_dict(l) for l in logs], "next_cursor": next_cursor}),
+        ]
+        if "leaderboard" in topics:
+            frames.append(await board_frame(server.broker))
+        return frames
+
+    return await live_stream(request, server.broker, topics, first_frames)
+
+
+@endpoint
+async def leaderboard_stream(request, session):
+    async def first_frames():
+        return [await board_frame(server.broker)]
+
+    return await live_stream(request, server.broker, ["leaderboard"], first_frames)
+
+
+@endpoint
+async def api_events(request, session):
+    user = session.user("uid")
+    topics = [f"user:{user.id}"]
+    if request.query_params.get("leaderboard"):
+        topics.append("leaderboard")
+
+    async def first_frames():
+        async with engine.connect() as conn:
+            known = await lookup(api_app.user_directory, conn, user)
+        frames = [sse("total", {"total_co2": round(known.total_co2 if known else 0.0, 4)})]
+        if "leaderboard" in topics:
+            frames.append(await board_frame(api_app.broker))
+        return frames
+
+    return await live_stream(request, api_app.broker, topics, first_frames)
+
+
+@endpoint
+async def api_leaderboard_stream(request, session):
+    async def first_frames():
+        return [await board_frame(api_app.broker)]
+
+    return await live_stream(request, api_app.broker, ["leaderboard"], first_frames)
+
+
+# ---------------------------
+# App
+# ---------------------------
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    parse_executor.shutdown(wait=False)
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/bulk", chat_bulk, methods=["POST"]),
+        Route("/history", history),
+        Route("/stats", stats),
+        Route("/leaderboard", leaderboard),
+        Route("/leaderboard/me", leaderboard_me),
+        Route("/leaderboard/stream", leaderboard_stream),
+        Route("/events", events),
+        Route("/api/parse", api_parse, methods=["POST"]),
+        Route("/api/parse/batch", api_parse_batch, methods=["POST"]),
+        Route("/api/save", api_save, methods=["POST"]),
+        Route("/api/save/bulk", api_save_bulk, methods=["POST"]),
+        Route("/api/logs", api_logs),
+        Route("/api/leaderboard", api_leaderboard),
+        Route("/api/leaderboard/stream", api_leaderboard_stream),
+        Route("/api/events", api_events),
+    ],
+    lifespan=lifespan,
+)
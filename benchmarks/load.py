@@ -0,0 +1,281 @@
+"""
+Load test comparing the WSGI server (flask run) with the ASGI entry point
+(uvicorn asgi:app) on a read-heavy dashboard mix:
+
+    GET  /stats, /history?limit=20, /leaderboard, /leaderboard/me, /api/logs
+    POST /api/parse, and an /api/save now and then
+
+    python benchmarks/load.py --spawn            # both, each on a scratch copy of the repo
+    python benchmarks/load.py --target asgi=http://127.0.0.1:8000 --concurrency 200
+    python benchmarks/load.py --target wsgi=http://127.0.0.1:5000,http://127.0.0.1:5001
+
+Every virtual user keeps its own session cookie and saves a few entries
+before the timed run, so the read endpoints have history to page through.
+Under WSGI the /api routes belong to app.py, so that target is two
+servers (server.py, then app.py). --spawn starts each target in its own
+temporary copy of the app (fresh database) and needs flask, uvicorn,
+starlette and aiosqlite installed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+TEXTS = [
+    "drove 12 km by car",
+    "ate 2 eggs and drove 5 km",
+    "took the bus 8 km and had a chicken sandwich",
+    "used 3 kwh of electricity",
+    "ate 200g beef for lunch",
+]
+
+# (weight, method, path, body)
+MIX = [
+    (30, "GET", "/stats", None),
+    (20, "GET", "/history?limit=20", None),
+    (15, "GET", "/leaderboard", None),
+    (10, "GET", "/leaderboard/me", None),
+    (10, "GET", "/api/logs", None),
+    (12, "POST", "/api/parse", lambda rng: {"text": rng.choice(TEXTS)}),
+    (3, "POST", "/api/save", lambda rng: {"text": "x", "parsed": [{"activity": "bus", "quantity": 3, "unit": "km"}]}),
+]
+
+
+# ---------------------------
+# Minimal HTTP/1.1 client
+# ---------------------------
+class Client:
+    """One virtual user: a keep-alive connection (reopened when the server closes it) and a cookie."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.cookie = None
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is not None:
+            try:
+                return await self._send(method, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()  # the server dropped the idle keep-alive connection: retry once on a new one
+        return await self._send(method, path, body)
+
+    async def _send(self, method, path, body):
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(payload)}"]
+        if body is not None:
+            head.append("Content-Type: application/json")
+        if self.cookie:
+            head.append(f"Cookie: {self.cookie}")
+        data = ("\r\n".join(head) + "\r\n\r\n").encode() + payload
+
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(data)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        version, status = status_line.split()[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip()
+            if name == "set-cookie":
+                self.cookie = value.split(";", 1)[0]
+            headers[name] = value
+        if "content-length" in headers:
+            content = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            content = await self.reader.read()  # HTTP/1.0 style: body runs to EOF
+        if version == b"HTTP/1.0" or headers.get("connection", "").lower() == "close" or "content-length" not in headers:
+            self.close()
+        return int(status), content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# ---------------------------
+# Running a target
+# ---------------------------
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+class VirtualUser:
+    """Routes /api/* to `api_url` when the target serves it separately (app.py under WSGI)."""
+
+    def __init__(self, url, api_url=None):
+        self.main = Client(url)
+        self.api = Client(api_url) if api_url else self.main
+
+    def request(self, method, path, body=None):
+        client = self.api if path.startswith("/api/") else self.main
+        return client.request(method, path, body)
+
+    def close(self):
+        self.main.close()
+        self.api.close()
+
+
+async def seed(client, rng, writes, errors):
+    # /chat is rate limited per address, so only the first few users get chat history
+    try:
+        await client.request("POST", "/chat", {"prompt": rng.choice(TEXTS)})
+        for _ in range(writes):
+            await client.request("POST", "/api/save", {"text": "x", "parsed": [{"activity": "car", "quantity": 4, "unit": "km"}]})
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        client.close()
+        errors["seed"] = errors.get("seed", 0) + 1
+
+
+async def virtual_user(client, rng, deadline, latencies, errors):
+    weights = [w for w, _, _, _ in MIX]
+    while time.monotonic() < deadline:
+        _, method, path, body = rng.choices(MIX, weights)[0]
+        started = time.perf_counter()
+        try:
+            status, _ = await client.request(method, path, body(rng) if body else None)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            client.close()
+            errors["connection"] = errors.get("connection", 0) + 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            errors[status] = errors.get(status, 0) + 1
+
+
+async def run_target(urls, concurrency, duration, writes):
+    latencies, errors = [], {}
+    users = [(VirtualUser(*urls), random.Random(i)) for i in range(concurrency)]
+    await asyncio.gather(*(seed(client, rng, writes, errors) for client, rng in users))
+
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(virtual_user(client, rng, deadline, latencies, errors) for client, rng in users))
+    wall = time.monotonic() - started
+    for client, _ in users:
+        client.close()
+
+    latencies.sort()
+    if not latencies:
+        return {"requests": 0, "rps": 0, "p50_ms": None, "p99_ms": None, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / wall),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "errors": errors,
+    }
+
+
+# ---------------------------
+# Spawning the servers
+# ---------------------------
+def scratch_copy():
+    # a copy of the app with its own (empty) instance/ directory
+    path = tempfile.mkdtemp(prefix="carbon-load-")
+    for name in os.listdir(ROOT):
+        if name.endswith(".py") or name == "emission_factors.json":
+            shutil.copy(os.path.join(ROOT, name), path)
+    shutil.copytree(os.path.join(ROOT, "templates"), os.path.join(path, "templates"))
+    return path
+
+
+def wait_until_up(url, timeout=30.0):
+    async def probe():
+        client = Client(url)
+        try:
+            await client.request("GET", "/stats")
+            return True
+        except OSError:
+            return False
+        finally:
+            client.close()
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if asyncio.run(probe()):
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def server_commands(port):
+    # name -> [(port, command)]; under WSGI the /api routes are app.py's, a separate server
+    flask = [sys.executable, "-m", "flask", "--app"]
+    return {
+        "wsgi": [
+            (port, flask + ["server", "run", "--port", str(port), "--with-threads"]),
+            (port + 1, flask + ["app", "run", "--port", str(port + 1), "--with-threads"]),
+        ],
+        "asgi": [
+            (port + 2, [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port + 2), "--log-level", "warning"]),
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", default=[], help="name=url[,api_url] of a running server; api_url serves /api/* if separate")
+    parser.add_argument("--spawn", action="store_true", help="start flask run and uvicorn on a scratch copy")
+    parser.add_argument("--port", type=int, default=8760, help="first port used by --spawn")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per target")
+    parser.add_argument("--seed-writes", type=int, default=3, help="/api/save calls per virtual user before timing")
+    args = parser.parse_args(argv)
+
+    targets = [(name, urls.split(",")) for name, urls in (t.split("=", 1) for t in args.target)]
+    processes, workdirs = [], []
+    if args.spawn:
+        for name, servers in server_commands(args.port).items():
+            workdirs.append(scratch_copy())  # one database per target
+            for port, command in servers:
+                processes.append(
+                    subprocess.Popen(command, cwd=workdirs[-1], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                )
+            targets.append((name, [f"http://127.0.0.1:{port}" for port, _ in servers]))
+    if not targets:
+        parser.error("give --spawn or at least one --target")
+
+    try:
+        results = {}
+        for name, urls in targets:
+            for url in urls:
+                wait_until_up(url)
+            results[name] = asyncio.run(run_target(urls, args.concurrency, args.duration, args.seed_writes))
+            print(f"✅ {name} done")
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+            process.wait(timeout=10)
+        for workdir in workdirs:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'target':8} {'requests':>9} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8}  errors")
+    for name, r in results.items():
+        print(f"{name:8} {r['requests']:>9} {r['rps']:>7} {r['p50_ms']!s:>8} {r['p99_ms']!s:>8}  {r['errors'] or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Caches for read endpoints.
+
+- TTLCache: thread-safe in-process LRU whose entries also expire after a
+  TTL (the default backend).
+- SQLiteCache: the same interface on a local SQLite file, so every worker
+  process on a host shares entries and invalidations.
+- ResponseCache: a view decorator on top of either backend that caches
+  200 JSON responses per user or globally and answers If-None-Match
+  with 304.
+
+Entries carry tags (typically "user:<id>") so everything derived from one
+user's data can be dropped in one call when that user writes.
+"""
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, max_entries=10000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= time.monotonic():
+                if entry is not _MISSING:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate(self, tag):
+        """Drop every entry stored with `tag`; returns how many were dropped."""
+        with self._lock:
+            keys = self._tags.pop(tag, ())
+            for key in list(keys):
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self.max_entries}
+
+    def _drop(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteCache:
+    """
+    TTLCache's interface backed by a SQLite file, shared by all processes
+    that open the same path. Values are pickled, so only point it at a
+    private local file.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._writes = 0
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key))")
+            db.execute("CREATE INDEX IF NOT EXISTS ix_entries_expires ON entries (expires)")
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")  # it is only a cache
+            self._local.db = db
+        return db
+
+    def get(self, key, default=None):
+        row = self._db().execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, pickle.dumps(value), expires))
+            db.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", [(tag, key) for tag in tags])
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def delete(self, key):
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            db.execute("DELETE FROM tags WHERE key = ?", (key,))
+
+    def invalidate(self, tag):
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            dropped = db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM tags WHERE tag = ?)", (tag,)
+            ).rowcount
+            db.execute("DELETE FROM tags WHERE tag = ?", (tag,))
+        return dropped
+
+    def clear(self):
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM entries")
+            db.execute("DELETE FROM tags")
+
+    def stats(self):
+        size = self._db().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size, "max_size": self.max_entries}
+
+    def _prune(self):
+        # drop expired entries, then the soonest-to-expire ones beyond max_entries
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+            db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            db.execute("DELETE FROM tags WHERE key NOT IN (SELECT key FROM entries)")
+
+
+def make_cache_backend(config):
+    """
+    RESPONSE_CACHE_BACKEND = "memory" (default) or "sqlite" (shared by all
+    workers through RESPONSE_CACHE_PATH).
+    """
+    kind = config.get("RESPONSE_CACHE_BACKEND", "memory")
+    max_entries = config.get("RESPONSE_CACHE_MAX_ENTRIES", 10000)
+    ttl = config.get("RESPONSE_CACHE_TTL", 5.0)
+    if kind == "sqlite":
+        return SQLiteCache(config.get("RESPONSE_CACHE_PATH", "response_cache.db"), max_entries, ttl)
+    if kind == "memory":
+        return TTLCache(max_entries, ttl)
+    raise ValueError(f"unknown RESPONSE_CACHE_BACKEND: {kind}")
+
+
+class ResponseCache:
+    """
+    Caches whole 200 responses of read endpoints and serves ETags.
+
+        responses = ResponseCache(make_cache_backend(app.config))
+
+        @app.route("/history")
+        @responses.cached(scope="user", user_id=lambda: session.get("user_id"))
+        def history(): ...
+
+    The key is endpoint + owner + query string; `ttl` defaults to the
+    backend's. scope="user" entries are
+    tagged with the user and dropped by invalidate_user(); scope="global"
+    entries only expire. Requests with a matching If-None-Match get an
+    empty 304, whether or not the body came from the cache.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def cached(self, scope="user", ttl=None, user_id=None):
+        if scope not in ("user", "global"):
+            raise ValueError("scope must be 'user' or 'global'")
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if scope == "user":
+                    owner = user_id()
+                    if not owner:
+                        # no session user yet: nothing to key on
+                        return view(*args, **kwargs)
+                    tags = (self.user_tag(owner),)
+                else:
+                    owner, tags = "*", ()
+
+                key = f"{request.endpoint}|{owner}|{request.query_string.decode()}"
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+                    self.backend.set(key, entry, ttl=ttl, tags=tags)
+                return self.respond(entry, private=scope == "user")
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    def respond(entry, private):
+        body, mimetype, etag = entry
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        # let clients keep the body but always revalidate with If-None-Match
+        response.headers["Cache-Control"] = "private, no-cache" if private else "no-cache"
+        return response
+
+    @staticmethod
+    def user_tag(user_id):
+        return f"user:{user_id}"
+
+    def invalidate_user(self, user_id):
+        return self.backend.invalidate(self.user_tag(user_id))
@@ -1,158 +1,378 @@
-def calculate_carbon(activity: str):
-    import re
-
-    # ---------------------------------------
-    # 📌 GLOBAL EMISSION FACTORS (kg CO2e)
-    # ---------------------------------------
-
-    EMISSION_FACTORS = {
-        "transport": {
-            "car": 0.20,           # kg per km
-            "motorbike": 0.10,
-            "bus": 0.05,
-            "train": 0.03,
-            "flight": 0.25,        # per km (short estimate)
-            "cycle": 0.0,          # saved = 0.2 * km
-            "walk": 0.0,
-        },
-        "energy": {
-            "electricity": 0.82,   # per kWh (India avg)
-            "lpg": 2.98,           # per kg
-            "natural_gas": 1.90    # per m³
-        },
-        "food": {
-            "beef": 27.0,          # per kg
-            "chicken": 6.9,
-            "milk": 1.3,
-            "rice": 2.7,
-            "vegetables": 0.5,
-        },
-        "waste": {
-            "plastic": 6.0,        # per kg
-            "paper": 1.3
-        }
+import re
+import difflib
+import threading
+from collections import Counter, OrderedDict
+
+import factors
+
+
+# ---------------------------------------
+# 📌 COMPILED ACTIVITY MATCHER
+# ---------------------------------------
+class ActivityMatcher:
+    """
+    Finds the winning activity of a factor table in one pass over the text.
+
+    The table is the usual nested {category: {key: factor}} dict. Keys are
+    ranked in table order (category order first, then key order inside the
+    category), which is the same order the old per-category loops used, and
+    the winner is the best-ranked key that appears anywhere in the text.
+
+    All keys (and their aliases) are folded into a single alternation inside a
+    lookahead, so one `finditer` sweep reports the best-ranked key starting at
+    every position, overlaps included. Matching stays a plain substring test
+    like before ("cycled" still matches "cycle").
+    """
+
+    def __init__(self, table: dict, aliases: dict = None):
+        self.rank = {}      # matched text -> rank of its key
+        self.entries = []   # rank -> (category, key)
+
+        for category, keys in table.items():
+            for key in keys:
+                self.rank[key] = len(self.entries)
+                self.entries.append((category, key))
+
+        for alias, key in (aliases or {}).items():
+            if key in self.rank and alias not in self.rank:
+                self.rank[alias] = self.rank[key]
+
+        if self.rank:
+            # longer spellings first, so an alias never hides a longer key
+            # that starts at the same position
+            ordered = sorted(self.rank, key=lambda k: (self.rank[k], -len(k)))
+            alternation = "|".join(re.escape(k) for k in ordered)
+            self.pattern = re.compile(f"(?=({alternation}))")
+        else:
+            self.pattern = None
+
+    def match(self, text: str):
+        """
+        Returns (category, key) of the winning activity, or None.
+        """
+        if self.pattern is None:
+            return None
+        best = None
+        for m in self.pattern.finditer(text):
+            r = self.rank[m.group(1)]
+            if best is None or r < best:
+                best = r
+                if r == 0:
+                    break
+        return None if best is None else self.entries[best]
+
+
+def get_matcher(table=None) -> ActivityMatcher:
+    """
+    The compiled matcher for a factor table (default: the current one); it
+    is built once per loaded table.
+    """
+    table = table or factors.current()
+    return table.derived("matcher", lambda t: ActivityMatcher(t.categories, t.aliases))
+
+
+# ---------------------------------------
+# 📌 MEMOIZED FUZZY RESOLVER
+# ---------------------------------------
+class FuzzyResolver:
+    """
+    Drop-in for `difflib.get_close_matches(word, choices, n=1, cutoff)[0]`
+    that does not run SequenceMatcher against every choice.
+
+    - exact choices are answered straight from a set
+    - a character n-gram index (n=1, with counts) gives each choice's
+      matching-character upper bound in one pass over the word; this is the
+      same bound difflib's quick_ratio uses, so choices that fail it can be
+      skipped without changing the answer
+    - only the survivors get the full ratio(), and ties are broken the way
+      get_close_matches breaks them (higher score, then larger string)
+    - resolved words, misses included, sit in a bounded LRU cache
+    """
+
+    _MISSING = object()
+
+    def __init__(self, choices, cutoff: float = 0.6, cache_size: int = 4096):
+        self.choices = tuple(choices)
+        self.cutoff = cutoff
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._exact = set(self.choices)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        # char -> [(choice, count of char in choice)]
+        self._index = {}
+        for choice in self._exact:
+            for ch, count in Counter(choice).items():
+                self._index.setdefault(ch, []).append((choice, count))
+
+    def resolve(self, word: str):
+        with self._lock:
+            cached = self._cache.get(word, self._MISSING)
+            if cached is not self._MISSING:
+                self._cache.move_to_end(word)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        match = self._lookup(word)
+
+        with self._lock:
+            self._cache[word] = match
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return match
+
+    def _lookup(self, word: str):
+        if word in self._exact:
+            return word
+
+        shared = {}
+        for ch, count in Counter(word).items():
+            for choice, choice_count in self._index.get(ch, ()):
+                shared[choice] = shared.get(choice, 0) + min(count, choice_count)
+
+        best = None
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(word)
+        for choice, common in shared.items():
+            if 2.0 * common / (len(choice) + len(word)) < self.cutoff:
+                continue
+            matcher.set_seq1(choice)
+            score = matcher.ratio()
+            if score >= self.cutoff and (best is None or (score, choice) > best):
+                best = (score, choice)
+        return best[1] if best else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "max_size": self.cache_size,
+            }
+
+
+_resolvers = {}
+
+
+def get_resolver(choices) -> FuzzyResolver:
+    """
+    Returns the shared resolver for a list of choices, building a new one
+    (with a fresh cache) whenever the choices change.
+    """
+    key = tuple(choices)
+    resolver = _resolvers.get(key)
+    if resolver is None:
+        resolver = _resolvers[key] = FuzzyResolver(key)
+    return resolver
+
+
+# ---------------------------------------
+# 📌 EMISSION FACTORS (kg CO2e): see factors.py / emission_factors.json
+# ---------------------------------------
+SAVING_MODES = ("cycle", "walk")
+
+# words that make a missing quantity default to 1 km of travel
+TRAVEL_HINTS = ("car", "cycle", "bike", "walk", "bus", "train")
+
+
+# ---------------------------------------
+# 📌 SMART NUMBER EXTRACTOR
+# ---------------------------------------
+QUANTITY_RE = re.compile(r"(\d+(\.\d+)?)\s*(km|kwh|kw|kg|m3)")
+UNIT_MAP = {"km": "km", "kwh": "kwh", "kw": "kwh", "kg": "kg", "m3": "m3"}
+
+
+def extract_quantity(text: str):
+    """
+    Try to extract a numeric quantity and a unit from the text.
+    Returns (value: float or None, unit_type: str or None, unit_raw: str or None)
+    """
+    # capture patterns like "12 km", "3.5 kwh", "0.2 kg", "2 m3"
+    m = QUANTITY_RE.search(text.lower())
+    if m:
+        raw_unit = m.group(3)
+        return float(m.group(1)), UNIT_MAP.get(raw_unit, raw_unit), raw_unit
+    return None, None, None
+
+
+def match_activity(text: str, table=None):
+    """
+    Single-pass lookup of the winning (category, key) in the factor table,
+    aliases included ("natural gas" for natural_gas).
+    """
+    return get_matcher(table).match(text)
+
+
+# ---------------------------------------
+# 📌 MAIN CALCULATOR
+# ---------------------------------------
+def calculate(activity: str):
+    """
+    Structured carbon calculation for one free-text activity.
+    Returns a dict:
+    {
+      activity: "car",
+      category: "transport",
+      quantity: 12,
+      unit: "km",
+      co2: -2.4,  # positive means saved, negative means emitted
+      message: "...",
+      factor_version: "2026.1"
     }
+    """
+    table = factors.current()
+    result = _calculate(activity, table)
+    result["factor_version"] = table.version
+    return result
+
 
+def _calculate(activity: str, table):
+    text = (activity or "").lower().strip()
+    qty, unit_type, unit_raw = extract_quantity(text)
+    if qty is None:
+        # sensible defaults when quantity is missing for travel: assume 1 km
+        if any(w in text for w in TRAVEL_HINTS):
+            qty = 1.0
+            unit_type = "km"
+            unit_raw = "km"
+        else:
+            qty = 1.0  # fallback generic
 
-    # ---------------------------------------
-    # 📌 SMART NUMBER EXTRACTOR
-    # ---------------------------------------
-    def extract_quantity(text: str):
-        # km, kwh, kg, m3
-        units = {
-            "km": "distance",
-            "kwh": "energy",
-            "kw": "energy",
-            "kg": "weight",
-            "m3": "volume"
+    category, key = match_activity(text, table) or (None, None)
+    factor = table.factors.get(key)
+
+    # transport
+    if category == "transport":
+        mode = key
+        if mode in SAVING_MODES:
+            # treated as saving vs car
+            saved = qty * table.factors["car"]
+            return {
+                "activity": mode,
+                "category": "transport",
+                "quantity": qty,
+                "unit": unit_type or "km",
+                "co2": round(+saved, 6),
+                "message": f"🚴 {mode.title()} {qty} {unit_raw} saved {saved:.2f} kg CO₂",
+            }
+        emitted = qty * factor
+        return {
+            "activity": mode,
+            "category": "transport",
+            "quantity": qty,
+            "unit": unit_type or "km",
+            "co2": round(-emitted, 6),
+            "message": f"🚗 {mode.title()} {qty} {unit_raw} emitted {emitted:.2f} kg CO₂",
         }
-        
-        match = re.search(r"(\d+(\.\d+)?)\s*(km|kwh|kw|kg|m3)", text)
-        if match:
-            return float(match.group(1)), units.get(match.group(3))
-        
-        return None, None
-
-
-    # ---------------------------------------
-    # 📌 MAIN CALCULATOR
-    # ---------------------------------------
-    def calculate_carbon(activity: str):
-        activity = activity.lower()
-
-        # Extract value + unit
-        qty, unit_type = extract_quantity(activity)
-
-        # Default values
-        if qty is None:
-            qty = 1  # fallback if user did not specify value
-
-        # ---------------------------------------
-        # TRANSPORT
-        # ---------------------------------------
-        for mode, factor in EMISSION_FACTORS["transport"].items():
-            if mode in activity:
-                if mode in ["cycle", "walk"]:
-                    saved = qty * 0.20  # assume car alternative saves 0.2 per km
-                    return {
-                        "activity": mode,
-                        "raw_input": activity,
-                        "quantity": qty,
-                        "unit": "km",
-                        "type": "saved",
-                        "co2": saved,
-                        "message": f"🚴 {mode.title()} {qty} km saved {saved:.2f} kg CO₂"
-                    }
-                else:
-                    emitted = qty * factor
-                    return {
-                        "activity": mode,
-                        "raw_input": activity,
-                        "quantity": qty,
-                        "unit": "km",
-                        "type": "emitted",
-                        "co2": -emitted,
-                        "message": f"🚗 {mode.title()} {qty} km emitted {emitted:.2f} kg CO₂"
-                    }
-
-        # ---------------------------------------
-        # ENERGY
-        # ---------------------------------------
-        for source, factor in EMISSION_FACTORS["energy"].items():
-            if source in activity:
-                emitted = qty * factor
-                return {
-                    "activity": source,
-                    "raw_input": activity,
-                    "quantity": qty,
-                    "unit": "kWh" if unit_type == "energy" else "units",
-                    "type": "emitted",
-                    "co2": -emitted,
-                    "message": f"⚡ Using {qty} kWh {source} emitted {emitted:.2f} kg CO₂"
-                }
-
-        # ---------------------------------------
-        # FOOD
-        # ---------------------------------------
-        for food, factor in EMISSION_FACTORS["food"].items():
-            if food in activity:
-                emitted = qty * factor
-                return {
-                    "activity": food,
-                    "raw_input": activity,
-                    "quantity": qty,
-                    "unit": "kg",
-                    "type": "emitted",
-                    "co2": -emitted,
-                    "message": f"🍗 Eating {qty} kg of {food} emitted {emitted:.2f} kg CO₂"
-                }
-
-        # ---------------------------------------
-        # WASTE
-        # ---------------------------------------
-        for item, factor in EMISSION_FACTORS["waste"].items():
-            if item in activity:
-                emitted = qty * factor
-                return {
-                    "activity": item,
-                    "raw_input": activity,
-                    "quantity": qty,
-                    "unit": "kg",
-                    "type": "emitted",
-                    "co2": -emitted,
-                    "message": f"🗑️ Disposing {qty} kg of {item} emitted {emitted:.2f} kg CO₂"
-                }
-
-        # ---------------------------------------
-        # NONE MATCHED
-        # ---------------------------------------
+
+    # energy
+    if category == "energy":
+        source = key
+        emitted = qty * factor
         return {
-            "activity": "unknown",
-            "raw_input": activity,
-            "quantity": 0,
-            "unit": "",
-            "type": "none",
-            "co2": 0.0,
-            "message": "🤔 I couldn't understand that activity."
+            "activity": source,
+            "category": "energy",
+            "quantity": qty,
+            "unit": unit_type or "kWh",
+            "co2": round(-emitted, 6),
+            "message": f"⚡ {source.title()} use {qty} {unit_raw or 'units'} emitted {emitted:.2f} kg CO₂",
         }
 
+    # food
+    if category == "food":
+        food = key
+        emitted = qty * factor
+        return {
+            "activity": food,
+            "category": "food",
+            "quantity": qty,
+            "unit": unit_type or "kg",
+            "co2": round(-emitted, 6),
+            "message": f"🍽️ {qty} {unit_raw or 'kg'} of {food} emitted {emitted:.2f} kg CO₂",
+        }
+
+    # waste
+    if category == "waste":
+        item = key
+        emitted = qty * factor
+        return {
+            "activity": item,
+            "category": "waste",
+            "quantity": qty,
+            "unit": unit_type or "kg",
+            "co2": round(-emitted, 6),
+            "message": f"🗑️ Disposing {qty} {unit_raw or 'kg'} of {item} emitted {emitted:.2f} kg CO₂",
+        }
+
+    # fallback: couldn't identify specific category
+    return {
+        "activity": "unknown",
+        "category": "unknown",
+        "quantity": qty,
+        "unit": unit_type or "",
+        "co2": 0.0,
+        "message": "🤔 Could not determine activity. Try phrases like 'drove 5 km', 'cycled 3 km', or 'used 2 kWh electricity'.",
+    }
+
+
+def calculate_many(activities):
+    """
+    Runs `calculate` over an iterable of activity strings, all against the
+    same factor table. Returns a list of result dicts in input order.
+    """
+    table = factors.current()
+    results = [_calculate(a, table) for a in activities]
+    for result in results:
+        result["factor_version"] = table.version
+    return results
+
+
+def rescore(activities, quantities, table=None):
+    """
+    Re-scores stored rows column-wise (see recompute.py): `activities` are
+    the logged prompts and `quantities` their stored quantities. The
+    activity match is per row; quantities times per-unit rates is one
+    NumPy multiply over the batch when numpy is installed (it is optional,
+    as for app.py's scoring), and only the rounding goes back to Python's
+    round() so the values stay equal to what `calculate` gives.
+    Returns (categories, co2s).
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    table = table or factors.current()
+    matcher = get_matcher(table)
+    hits = [matcher.match((a or "").lower().strip()) or ("unknown", None) for a in activities]
+
+    # co2 per unit: + car factor for saving modes, - own factor otherwise
+    car = table.factors["car"]
+    rates = [0.0 if key is None else car if key in SAVING_MODES else -table.factors[key] for _, key in hits]
+    if np is None:
+        products = [(1.0 if q is None else q) * r for q, r in zip(quantities, rates)]
+    else:
+        qtys = np.array(quantities, dtype=np.float64)  # a missing quantity (None) becomes NaN, scored as 1
+        qtys[np.isnan(qtys)] = 1.0
+        products = (qtys * np.array(rates, dtype=np.float64)).tolist()
+    co2s = [round(co2, 6) for co2 in products]
+    return [category for category, _ in hits], co2s
+
+
+def calculate_carbon(activity: str):
+    """
+    Kept for older callers: `calculate` plus the legacy `raw_input` and
+    `type` ("saved" / "emitted" / "none") fields.
+    """
+    result = calculate(activity)
+    if result["category"] == "unknown":
+        kind = "none"
+    elif result["activity"] in SAVING_MODES:
+        kind = "saved"
+    else:
+        kind = "emitted"
+    return dict(result, raw_input=(activity or "").lower(), type=kind)
@@ -0,0 +1,180 @@
+"""
+Per-user running CO₂ totals maintained in SQL.
+
+Writers never load the user row: a log insert is followed, in the same
+transaction, by
+
+    UPDATE users SET total_co2 = COALESCE(total_co2, 0) + :delta
+    WHERE id = :uid RETURNING total_co2
+
+so concurrent workers cannot lose each other's updates and no SELECT is
+needed before the write.
+
+Hot users (bulk importers, load tests) can be switched to sharded
+counters: their deltas are upserted into one of `shards` rows of a small
+shard table, picked at random, so concurrent writers rarely touch the
+same row. A user's total is then users.total_co2 plus the SUM of their
+shard rows, until `fold()` moves the shards into users.total_co2.
+
+The shard model (one per app) needs user_id, shard and co2 columns with
+(user_id, shard) as its primary key. `reconcile()` compares every total
+with SUM(co2) over the log table.
+"""
+import time
+import random
+
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from recompute import rebuild_totals
+
+
+class TotalCounter:
+    def __init__(self, db, user_model, log_model, shard_model=None, shards=0, sharded_users=(), fold_seconds=30.0):
+        """
+        `sharded_users` are the ids whose deltas go to `shards` shard rows;
+        everyone else is updated in place. Sharding is off unless both
+        `shard_model` and `shards` are set.
+        """
+        self.db = db
+        self.users = user_model.__table__
+        self.logs = log_model.__table__
+        self.user_model = user_model
+        self.log_model = log_model
+        self.shard_table = shard_model.__table__ if shard_model is not None else None
+        self.shards = shards if shard_model is not None else 0
+        self.sharded_users = frozenset(sharded_users)
+        self.fold_seconds = fold_seconds
+        self._folded_at = time.monotonic()
+
+        users = self.users
+        # executemany-able: {"uid": ..., "delta": ...}
+        self.increment = (
+            update(users)
+            .where(users.c.id == bindparam("uid"))
+            .values(total_co2=func.coalesce(users.c.total_co2, 0.0) + bindparam("delta"))
+        )
+
+    def is_sharded(self, user_id):
+        return self.shards > 0 and user_id in self.sharded_users
+
+    # ---------------------------
+    # writes (in the caller's transaction; the caller commits)
+    # ---------------------------
+    def add(self, user_id, delta):
+        """Add `delta` to the user's total and return the new total (None if the user row is missing)."""
+        if self.is_sharded(user_id):
+            self._add_to_shards([(user_id, delta)])
+            return self.total(user_id)
+        total = self.db.session.execute(
+            self.increment.returning(self.users.c.total_co2), {"uid": user_id, "delta": delta}
+        ).scalar()
+        # SQLite's RETURNING hands back -2 rather than -2.0 for whole numbers
+        return None if total is None else float(total)
+
+    def add_many(self, deltas):
+        """Apply {user_id: delta} with one executemany per kind of counter."""
+        sharded = [(uid, d) for uid, d in deltas.items() if self.is_sharded(uid)]
+        direct = [{"uid": uid, "delta": d} for uid, d in deltas.items() if not self.is_sharded(uid)]
+        if direct:
+            self.db.session.execute(self.increment, direct)
+        if sharded:
+            self._add_to_shards(sharded)
+
+    def _add_to_shards(self, deltas):
+        self.db.session.execute(self.shard_upsert(), self.shard_rows(deltas))
+
+    def shard_upsert(self):
+        table = self.shard_table
+        stmt = sqlite_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.shard], set_={"co2": table.c.co2 + stmt.excluded.co2}
+        )
+
+    def shard_rows(self, deltas):
+        # a random shard per delta spreads one user's writers over `shards` rows
+        return [{"user_id": uid, "shard": random.randrange(self.shards), "co2": d} for uid, d in deltas]
+
+    # ---------------------------
+    # reads
+    # ---------------------------
+    def total(self, user_id):
+        """The user's current total, including unfolded shards."""
+        total = self.db.session.execute(self.total_query(user_id)).scalar()
+        return None if total is None else float(total)
+
+    def total_query(self, user_id):
+        users = self.users
+        total = func.coalesce(users.c.total_co2, 0.0)
+        if self.shards:
+            shards = self.shard_table
+            pending = select(func.coalesce(func.sum(shards.c.co2), 0.0)).where(shards.c.user_id == user_id)
+            total = total + pending.scalar_subquery()
+        return select(total).where(users.c.id == user_id)
+
+    def totals(self):
+        """(user_id, total) for every user, including unfolded shards (the leaderboard loader)."""
+        users = self.users
+        if not self.shards:
+            return self.db.session.execute(select(users.c.id, users.c.total_co2)).all()
+        shards = self.shard_table
+        pending = (
+            select(shards.c.user_id, func.sum(shards.c.co2).label("co2")).group_by(shards.c.user_id).subquery()
+        )
+        return self.db.session.execute(
+            select(users.c.id, func.coalesce(users.c.total_co2, 0.0) + func.coalesce(pending.c.co2, 0.0)).outerjoin(
+                pending, pending.c.user_id == users.c.id
+            )
+        ).all()
+
+    # ---------------------------
+    # maintenance
+    # ---------------------------
+    def fold(self):
+        """
+        Move every shard row into users.total_co2 and commit. Rows are
+        deleted with RETURNING, so a delta upserted concurrently is either
+        folded now or left for the next fold, never counted twice.
+        """
+        if self.shard_table is None:
+            return 0
+        shards = self.shard_table
+        moved = self.db.session.execute(delete(shards).returning(shards.c.user_id, shards.c.co2)).all()
+        deltas = {}
+        for uid, co2 in moved:
+            deltas[uid] = deltas.get(uid, 0.0) + co2
+        if deltas:
+            self.db.session.execute(self.increment, [{"uid": uid, "delta": d} for uid, d in deltas.items()])
+        self.db.session.commit()
+        self._folded_at = time.monotonic()
+        return len(deltas)
+
+    def fold_if_due(self):
+        if self.shards and time.monotonic() - self._folded_at >= self.fold_seconds:
+            self.fold()
+
+    def rebuild(self):
+        """Reset every total to SUM(co2) of the user's logs, dropping the shards."""
+        if self.shard_table is not None:
+            self.db.session.execute(delete(self.shard_table))
+        return rebuild_totals(self.db, self.log_model, self.user_model)
+
+    def reconcile(self, fix=False, tolerance=1e-6):
+        """
+        [(user_id, stored total, SUM(co2) of logs)] for every user whose
+        total has drifted from the log table. Writes landing between the two
+        reads can show up as drift, so run it when writers are quiet; with
+        `fix` the totals are rebuilt afterwards.
+        """
+        logs = self.logs
+        sums = dict(self.db.session.execute(select(logs.c.user_id, func.sum(logs.c.co2)).group_by(logs.c.user_id)).all())
+        drifted = []
+        for uid, stored in self.totals():
+            stored, actual = float(stored or 0.0), float(sums.get(uid) or 0.0)
+            # relative for large totals: the two sides add the same floats in a different order
+            if abs(stored - actual) > tolerance * max(1.0, abs(actual)):
+                drifted.append((uid, stored, actual))
+        self.db.session.rollback()
+        if drifted and fix:
+            self.rebuild()
+        return drifted
@@ -0,0 +1,259 @@
+"""
+In-process pub/sub for Server-Sent Events, with coalescing.
+
+Write paths publish small facts as they commit ("user X's total is now T",
+"user X logged this", "the leaderboard changed"); nothing is sent right
+away. Every `interval` seconds one flusher thread takes what piled up and
+gives each topic's subscribers at most one message:
+
+- publish(topic, event, data): the latest value per (topic, event) wins,
+  so a user who logs fifty entries in a second causes one "total" event;
+- append(topic, event, item): items are kept in order (the newest
+  `max_items` per flush) and sent as one list;
+- board(topic, render): render() runs once per flush when the topic was
+  touch()ed, or every `refresh_seconds` to pick up writes made by other
+  processes, and is only sent when its output changed. A thousand open
+  dashboards cost one render and a thousand small writes per interval.
+
+    broker = Broker(interval=1.0)
+    broker.board("leaderboard", render_top_20)
+
+    broker.publish(f"user:{uid}", "total", {"total_co2": total})
+    broker.touch("leaderboard")
+
+    return event_stream(broker, broker.subscribe([f"user:{uid}"]), first=[sse("stats", payload)])
+
+Each subscription holds a small bounded queue of flushed messages; one
+that falls behind drops the oldest instead of growing (a later message
+carries the newer state anyway). Subscribers live in this process only,
+so with several workers a client sees the writes of the worker it is
+connected to right away and everybody else's at the next board refresh.
+"""
+import json
+import time
+import logging
+import asyncio
+import threading
+from collections import deque
+
+from flask import Response
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def sse(event, data):
+    """One SSE frame; data is sent as compact JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+KEEPALIVE = b": keepalive\n\n"
+
+
+class Subscription:
+    def __init__(self, topics, max_pending, loop=None):
+        """
+        `loop` is the asyncio loop of an ASGI handler that waits with
+        aget(); threaded (WSGI) handlers use get().
+        """
+        self.topics = tuple(topics)
+        self._messages = deque(maxlen=max_pending)
+        self._ready = threading.Condition()
+        self._loop = loop
+        self._wakeup = asyncio.Event() if loop is not None else None
+        self.closed = False
+
+    def put(self, message):
+        # called from the flusher thread
+        with self._ready:
+            self._messages.append(message)
+            self._ready.notify()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get(self, timeout):
+        """Everything flushed since the last call; b"" after `timeout` seconds of silence."""
+        with self._ready:
+            if not self._messages:
+                self._ready.wait(timeout)
+            return self._drain()
+
+    async def aget(self, timeout):
+        if not self._messages:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()  # before draining: a put() racing with us sets it again
+        with self._ready:
+            return self._drain()
+
+    def _drain(self):
+        message = b"".join(self._messages)
+        self._messages.clear()
+        return message
+
+
+class Broker:
+    def __init__(self, interval=1.0, max_subscribers=1000, max_pending=16, max_items=50, logger=None):
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_subscribers = max_subscribers
+        self.max_pending = max_pending
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()  # one board render at a time, so outputs only move forward
+        self._subscribers = {}  # topic -> set of Subscription
+        self._count = 0
+        self._latest = {}  # topic -> {event: data}
+        self._appended = {}  # topic -> {event: deque of items}
+        self._boards = {}  # topic -> [render, refresh_seconds, last output, rendered at, last sent output]
+        self._dirty = set()
+        self._thread = None
+        self.flushes = 0
+
+    # ---------------------------
+    # publishing (any thread; cheap and non-blocking)
+    # ---------------------------
+    def publish(self, topic, event, data):
+        with self._lock:
+            if topic in self._subscribers:
+                self._latest.setdefault(topic, {})[event] = data
+
+    def append(self, topic, event, item):
+        with self._lock:
+            if topic in self._subscribers:
+                events = self._appended.setdefault(topic, {})
+                events.setdefault(event, deque(maxlen=self.max_items)).append(item)
+
+    def board(self, topic, render, refresh_seconds=None):
+        """Register a rendered topic; render() returns the event's data."""
+        self._boards[topic] = [render, refresh_seconds, None, 0.0, None]
+
+    def touch(self, topic):
+        with self._lock:
+            self._dirty.add(topic)
+
+    # ---------------------------
+    # subscribing
+    # ---------------------------
+    def subscribe(self, topics, loop=None):
+        sub = Subscription(topics, self.max_pending, loop)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers()
+            for topic in sub.topics:
+                self._subscribers.setdefault(topic, set()).add(sub)
+            self._count += 1
+            self._start()
+        return sub
+
+    def unsubscribe(self, sub):
+        """Safe to call more than once (a stream's close callback and its generator both do)."""
+        with self._lock:
+            if sub.closed:
+                return
+            sub.closed = True
+            for topic in sub.topics:
+                subs = self._subscribers.get(topic)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[topic]
+            self._count -= 1
+
+    def current(self, topic):
+        """The board's data for a new subscriber, rendered unless a recent render is still current."""
+        state = self._boards[topic]
+        with self._render_lock:
+            refresh = state[1]
+            if state[2] is None or (refresh is not None and time.monotonic() - state[3] >= refresh):
+                self._render(state)
+                if state[2] != state[4]:
+                    self.touch(topic)  # newer than what subscribers were sent: the next flush sends it
+            return state[2]
+
+    def __len__(self):
+        return self._count
+
+    # ---------------------------
+    # flushing
+    # ---------------------------
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sse-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:  # a failing render must not stop the flusher
+                self.logger.exception("SSE flush failed")
+
+    def flush(self):
+        with self._lock:
+            latest, self._latest = self._latest, {}
+            appended, self._appended = self._appended, {}
+            dirty, self._dirty = self._dirty, set()
+            watched = set(self._subscribers)
+
+        messages = {}
+        for topic, events in latest.items():
+            messages[topic] = b"".join(sse(event, data) for event, data in events.items())
+        for topic, events in appended.items():
+            messages[topic] = messages.get(topic, b"") + b"".join(sse(e, list(items)) for e, items in events.items())
+        with self._render_lock:
+            now = time.monotonic()
+            for topic, state in self._boards.items():
+                refresh = state[1]
+                stale = refresh is not None and now - state[3] >= refresh
+                if topic not in watched:
+                    if topic in dirty:
+                        state[2] = state[4] = None  # nobody to tell now; current() renders it afresh
+                elif topic in dirty or stale:
+                    self._render(state)
+                    if state[2] != state[4]:
+                        state[4] = state[2]
+                        messages[topic] = sse(topic, state[2])
+
+        with self._lock:
+            targets = {topic: list(self._subscribers.get(topic, ())) for topic in messages}
+        for topic, message in messages.items():
+            for sub in targets[topic]:
+                sub.put(message)
+        self.flushes += 1
+
+    def _render(self, state):
+        # called with _render_lock held
+        state[2] = state[0]()
+        state[3] = time.monotonic()
+
+
+def event_stream(broker, sub, first=(), keepalive=15.0):
+    """
+    A Flask text/event-stream response: the `first` frames, then whatever
+    the broker flushes to `sub`, with a comment line every `keepalive`
+    seconds so proxies keep the connection open. Each open stream holds
+    one worker thread, so serve many dashboards from asgi.py. The
+    subscription is dropped when the response is closed, even if the
+    client went away before the generator started.
+    """
+
+    def generate():
+        try:
+            yield b"retry: 5000\n\n" + b"".join(first)
+            while True:
+                yield sub.get(keepalive) or KEEPALIVE
+        finally:
+            broker.unsubscribe(sub)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(lambda: broker.unsubscribe(sub))
+    return response
@@ -0,0 +1,148 @@
+"""
+Emission-factor registry shared by carbon_logic.py, server.py and app.py.
+
+The factors live in emission_factors.json (override the path with the
+EMISSION_FACTORS_PATH environment variable):
+
+    {"version": "2026.1",
+     "factors": [{"key": "car", "category": "transport", "unit": "km",
+                  "factor": 0.2, "aliases": []}, ...]}
+
+The file is read once into an immutable FactorTable with flat lookups.
+`current()` is a plain read of a module global and `reload()` builds a new
+table before swapping that global in a single assignment, so readers never
+lock and never see a half-loaded table. Callers should take `current()`
+once per calculation and use that table throughout, so one result never
+mixes two versions.
+
+Every stored log row records the version it was scored with.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emission_factors.json")
+
+Factor = namedtuple("Factor", "key category unit factor")
+
+# kg per serving unit, for food logged without a weight (app.py's parser
+# and the scoring.py engine share these)
+SERVING_WEIGHTS = {
+    "slice": 0.125,
+    "serving": 0.2,
+    "meal": 0.3,
+    "piece": 0.1,
+    "default": 0.2
+}
+
+
+class FactorTable:
+    def __init__(self, version, entries, aliases=None):
+        self.version = str(version)
+        self.entries = tuple(entries)  # file order; it ranks matches
+        self.by_key = {e.key: e for e in self.entries}
+        self.factors = {e.key: e.factor for e in self.entries}
+        self.categories = {}  # category -> {key: factor}, in file order
+        for e in self.entries:
+            self.categories.setdefault(e.category, {})[e.key] = e.factor
+        # alias -> key; an alias never shadows a real key
+        self.aliases = {a: k for a, k in (aliases or {}).items() if k in self.by_key and a not in self.by_key}
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, data):
+        entries, aliases, seen = [], {}, set()
+        for raw in data["factors"]:
+            key = raw["key"]
+            if key in seen:
+                raise ValueError(f"duplicate factor key: {key}")
+            seen.add(key)
+            factor = raw["factor"]
+            if isinstance(factor, bool) or not isinstance(factor, (int, float)):
+                raise ValueError(f"factor for {key} must be a number")
+            entries.append(Factor(key, raw["category"], raw["unit"], factor))
+            for alias in raw.get("aliases", ()):
+                aliases[alias] = key
+        return cls(data["version"], entries, aliases)
+
+    def keys(self, *categories):
+        """Factor keys in file order, optionally only from some categories."""
+        return [e.key for e in self.entries if not categories or e.category in categories]
+
+    def derived(self, name, build):
+        """
+        Memoize something computed from this table (a compiled matcher, a
+        fuzzy resolver); it is dropped along with the table on reload.
+        """
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build(self)
+        return value
+
+
+def load(path=None):
+    path = path or os.environ.get("EMISSION_FACTORS_PATH") or DEFAULT_PATH
+    with open(path, encoding="utf-8") as f:
+        return FactorTable.from_dict(json.load(f))
+
+
+_table = None
+_path = None
+_mtime = None
+_checked_at = 0.0
+_reload_lock = threading.Lock()  # only serializes reloaders
+
+
+def current():
+    table = _table
+    if table is None:
+        table = reload()
+    return table
+
+
+def reload(path=None):
+    """Load the factor file again and swap it in; returns the new table."""
+    global _table, _path, _mtime
+    with _reload_lock:
+        path = path or _path or os.environ.get("EMISSION_FACTORS_PATH") or DEFAULT_PATH
+        mtime = os.path.getmtime(path)
+        table = load(path)
+        _path, _mtime = path, mtime
+        _table = table
+    return table
+
+
+def reload_if_changed(every=5.0):
+    """
+    Cheap enough to call on every request: stats the factor file at most
+    once per `every` seconds and reloads it when its mtime changed. Returns
+    the new table, or None when nothing was reloaded.
+    """
+    global _checked_at
+    now = time.monotonic()
+    if _table is None or now - _checked_at < every or not _reload_lock.acquire(blocking=False):
+        return None
+    try:
+        _checked_at = now
+        changed = os.path.getmtime(_path) != _mtime
+    except OSError as e:
+        # the file is missing or unreadable mid-deploy: keep the old table
+        logging.getLogger(__name__).warning("emission factors not reloaded from %s: %s", _path, e)
+        return None
+    finally:
+        _reload_lock.release()
+    if not changed:
+        return None
+    try:
+        return reload()
+    except (OSError, ValueError, KeyError) as e:
+        # keep serving the old table; the next check tries again
+        logging.getLogger(__name__).warning("emission factors not reloaded from %s: %s", _path, e)
+        return None
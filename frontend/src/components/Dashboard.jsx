@@ -165,6 +165,37 @@ function Badge({ icon, title, desc }) {
   );
 }
 
+/* ---------- live data from the backend's /events stream (no polling) ---------- */
+function activity(log) {
+  const verb = log.co2 >= 0 ? "saved" : "emitted";
+  return {
+    id: log.id ?? `${log.created_at}-${log.activity}`,
+    text: `${log.activity} — ${Math.abs(log.co2).toFixed(2)} kg CO₂ ${verb}`,
+    time: (log.created_at || "").slice(11, 16),
+  };
+}
+
+function useLiveStats(setCarbonSavedKg, setRecent) {
+  useEffect(() => {
+    const source = new EventSource("/events");
+    const total = (e) => setCarbonSavedKg(JSON.parse(e.data).total_co2);
+    source.addEventListener("stats", total);
+    source.addEventListener("total", total);
+    source.addEventListener("history", (e) => {
+      setRecent(JSON.parse(e.data).items.slice(0, 5).map(activity));
+    });
+    source.addEventListener("log", (e) => {
+      // newest last; skip anything already shown (the snapshot can overlap the first push)
+      const fresh = JSON.parse(e.data).map(activity).reverse();
+      setRecent((items) => {
+        const seen = new Set(items.map((r) => r.id));
+        return fresh.filter((r) => !seen.has(r.id)).concat(items).slice(0, 5);
+      });
+    });
+    return () => source.close();
+  }, [setCarbonSavedKg, setRecent]);
+}
+
 /* ---------- Main Dashboard ---------- */
 export default function Dashboard() {
   // mock gamified stats
@@ -178,12 +209,13 @@ export default function Dashboard() {
   const [streak, setStreak] = useState(7);
   const [points, setPoints] = useState(420);
 
-  // recent activities and achievements (hard-coded)
-  const recent = [
+  // recent activities (sample until /events delivers the user's own) and achievements (hard-coded)
+  const [recent, setRecent] = useState([
     { id: 1, text: "Biked to work — 0.4 kg CO₂ saved", time: "2h" },
     { id: 2, text: "Recycled plastic — 1.2 kg", time: "1d" },
     { id: 3, text: "Hosted a carpool — 0.8 kg saved", time: "3d" },
-  ];
+  ]);
+  useLiveStats(setCarbonSavedKg, setRecent);
 
   const achievements = [
     { id: "a1", title: "First 100 XP", desc: "Completed first 100 XP", icon: <FaStar /> },
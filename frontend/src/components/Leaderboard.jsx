@@ -1,18 +1,36 @@
-import React from "react";
+import React, { useEffect, useState } from "react";
 import { motion } from "framer-motion";
 import { FaCrown, FaMedal } from "react-icons/fa";
 
+const samplePlayers = [
+  { id: 1, name: "Sufiyan", xp: 1280, level: 7, streak: 12 },
+  { id: 2, name: "Saalim", xp: 940, level: 5, streak: 9 },
+  { id: 3, name: "Yash", xp: 780, level: 4, streak: 5 },
+  { id: 4, name: "Vihaan", xp: 600, level: 3, streak: 4 },
+  { id: 5, name: "Ishaan", xp: 430, level: 3, streak: 2 },
+];
+
+// top 20 pushed by the backend's /leaderboard/stream whenever it changes (no polling)
+function useLiveBoard() {
+  const [players, setPlayers] = useState(samplePlayers);
+
+  useEffect(() => {
+    const source = new EventSource("/leaderboard/stream");
+    source.addEventListener("leaderboard", (e) => {
+      const users = JSON.parse(e.data);
+      setPlayers(users.map((u) => ({ id: u.id, name: u.name, xp: u.total_co2, unit: "kg CO₂" })));
+    });
+    return () => source.close();
+  }, []);
+
+  return players;
+}
+
 export default function Leaderboard() {
-  const players = [
-    { id: 1, name: "Sufiyan", xp: 1280, level: 7, streak: 12 },
-    { id: 2, name: "Saalim", xp: 940, level: 5, streak: 9 },
-    { id: 3, name: "Yash", xp: 780, level: 4, streak: 5 },
-    { id: 4, name: "Vihaan", xp: 600, level: 3, streak: 4 },
-    { id: 5, name: "Ishaan", xp: 430, level: 3, streak: 2 },
-  ];
+  const players = useLiveBoard();
 
-  // XP progress bar width
-  const maxXP = Math.max(...players.map((p) => p.xp));
+  // XP progress bar width (live totals can be negative: net emitted)
+  const maxXP = Math.max(1, ...players.map((p) => Math.abs(p.xp)));
 
   return (
     <div className="p-8 text-white max-w-4xl mx-auto">
@@ -49,16 +67,18 @@ export default function Leaderboard() {
             {/* User Info */}
             <div className="flex-1">
               <div className="font-semibold text-lg">{p.name}</div>
-              <div className="text-xs text-gray-400">
-                Level {p.level} • Streak {p.streak} days
-              </div>
+              {p.level != null && (
+                <div className="text-xs text-gray-400">
+                  Level {p.level} • Streak {p.streak} days
+                </div>
+              )}
 
               {/* XP Bar */}
               <div className="w-full bg-white/10 rounded-full h-3 mt-3 overflow-hidden">
                 <motion.div
                   initial={{ width: 0 }}
                   animate={{
-                    width: `${(p.xp / maxXP) * 100}%`,
+                    width: `${(Math.max(0, p.xp) / maxXP) * 100}%`,
                   }}
                   transition={{ duration: 0.7, ease: "easeOut" }}
                   className="h-3 rounded-full bg-gradient-to-r from-green-400 to-teal-400"
@@ -68,7 +88,9 @@ export default function Leaderboard() {
 
             {/* XP Number */}
             <div className="text-right">
-              <div className="font-bold text-lg">{p.xp} XP</div>
+              <div className="font-bold text-lg">
+                {p.xp} {p.unit || "XP"}
+              </div>
               <div className="text-xs text-gray-400">Total</div>
             </div>
           </motion.div>
@@ -0,0 +1,231 @@
+"""
+Request-scoped session users without a database round trip.
+
+The session cookie already carries the anonymous user id, so resolving
+"who is this" needs no query. The user's details (name, created_at,
+last-known total_co2, or "no row yet") are cached in two places: a small
+in-process TTL cache, and a profile in the signed session cookie itself,
+so a request that lands on a process that has not seen the user yet is
+still served without a query. Only when both are missing or older than
+the TTL does it cost one primary-key SELECT, which refreshes both.
+
+Writes made in a request keep that request's cookie in step (`written()`
+updates the total, `forget()` drops the profile). Changes made anywhere
+else (another browser of the same user, recompute, reconcile --fix) show
+up once the TTL runs out, the same bound the in-process cache has.
+
+Rows are created lazily: `ensure()` INSERT-OR-IGNOREs the user inside the
+first write's transaction (skipped once the user is known to exist), and
+`written()` records the new total after the commit. Writes that do not
+know the new total call `forget()` instead. "Known to exist" is only a
+cached belief (the row may have been deleted, or the cookie may come from
+another database), so a total increment that finds no row calls
+`recreate()` and retries instead of trusting it.
+
+    users = UserDirectory(db, User, counter)
+
+    user = users.current("user_id")     # once per request, cached on flask.g
+    user.id, user.total_co2             # no query on a cache hit
+    users.ensure(user); ...; db.session.commit(); users.written(user.id, total)
+"""
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from flask import g, has_request_context, session
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from cache import TTLCache
+
+Known = namedtuple("Known", "name created_at total_co2")
+NO_ROW = "no-row"  # cached: the id has no users row yet
+
+
+# ---------------------------
+# Profile cached in the session cookie
+# ---------------------------
+# `data` is the session mapping (flask.session, or asgi.py's cookie data)
+def read_profile(data, key, ttl):
+    """Known(...) or NO_ROW from the session, or None when absent or older than ttl seconds."""
+    profile = data.get(f"{key}_profile")
+    if not profile or time.time() - profile["at"] >= ttl:
+        return None
+    if "total" not in profile:
+        return NO_ROW
+    created = profile["created"]
+    return Known(profile["name"], datetime.fromisoformat(created) if created else None, profile["total"])
+
+
+def write_profile(data, key, known):
+    profile = {"at": time.time()}
+    if known is not NO_ROW:
+        created = known.created_at.isoformat() if known.created_at else None
+        profile.update(name=known.name, created=created, total=known.total_co2)
+    data[f"{key}_profile"] = profile
+
+
+def profile_written(data, key, total_co2):
+    """Record a committed total in the session's profile (dropped if it has none to update)."""
+    profile = data.get(f"{key}_profile")
+    if profile and "total" in profile:
+        data[f"{key}_profile"] = dict(profile, total=total_co2, at=time.time())
+    else:
+        data.pop(f"{key}_profile", None)  # the row was just created: read it once
+
+
+class SessionUser:
+    """The current request's user; details come from the directory on first use."""
+
+    def __init__(self, directory, key, user_id, created_at, is_new):
+        self.directory = directory
+        self.key = key  # session key of the user id
+        self.id = user_id
+        self.is_new = is_new  # the id was minted by this request
+        self._created_at = created_at
+        self._known = None
+
+    @property
+    def known(self):
+        if self._known is None:
+            self._known = NO_ROW if self.is_new else self.directory.resolve(self) or NO_ROW
+        return None if self._known is NO_ROW else self._known
+
+    @property
+    def exists(self):
+        return self.known is not None
+
+    @property
+    def name(self):
+        return self.known.name if self.known else None
+
+    @property
+    def created_at(self):
+        if self.known and self.known.created_at:
+            return self.known.created_at
+        return self._created_at
+
+    @property
+    def total_co2(self):
+        return self.known.total_co2 if self.known else 0.0
+
+
+class UserDirectory:
+    def __init__(self, db, user_model, counter=None, max_entries=100000, ttl=30.0, default_name=None):
+        """
+        `counter` (a counters.TotalCounter) supplies totals of sharded
+        users; `default_name(user_id)` names rows created by ensure().
+        """
+        self.db = db
+        self.users = user_model.__table__
+        self.counter = counter
+        self.default_name = default_name
+        self.cache = TTLCache(max_entries, ttl)
+
+    # ---------------------------
+    # resolving
+    # ---------------------------
+    def current(self, key="user_id"):
+        """The session user, minting an id (but no row) on the first visit."""
+        user = g.get("session_user")
+        if user is None:
+            user_id, is_new = session.get(key), False
+            if not user_id:
+                user_id, is_new = str(uuid.uuid4()), True
+                session[key] = user_id
+                session[f"{key}_created"] = datetime.utcnow().isoformat()
+            created = session.get(f"{key}_created")
+            created_at = datetime.fromisoformat(created) if created else None
+            user = g.session_user = SessionUser(self, key, user_id, created_at, is_new)
+        return user
+
+    def resolve(self, user):
+        """lookup() for a SessionUser: the in-process cache, then the session cookie, then the table."""
+        known = self.cache.get(user.id)
+        if known is None:
+            known = read_profile(session, user.key, self.cache.ttl)
+            if known is None:
+                known = self.lookup(user.id) or NO_ROW
+                write_profile(session, user.key, known)
+        return None if known is NO_ROW else known
+
+    def lookup(self, user_id):
+        """Known(...) for an existing user, None if there is no row yet."""
+        known = self.cache.get(user_id)
+        if known is None:
+            users = self.users
+            row = self.db.session.execute(
+                select(users.c.name, users.c.created_at, users.c.total_co2).where(users.c.id == user_id)
+            ).first()
+            if row is None:
+                known = NO_ROW
+            else:
+                total = row.total_co2 or 0.0
+                if self.counter is not None and self.counter.is_sharded(user_id):
+                    total = self.counter.total(user_id)
+                known = Known(row.name, row.created_at, float(total))
+            self.cache.set(user_id, known)
+        return None if known is NO_ROW else known
+
+    # ---------------------------
+    # writes
+    # ---------------------------
+    def ensure(self, user):
+        """Create the user's row in the current transaction unless it is known to exist."""
+        if not user.exists:
+            self.ensure_many([(user.id, user.created_at)])
+
+    def ensure_many(self, users):
+        """INSERT OR IGNORE rows for (user_id, created_at) pairs; the caller commits."""
+        rows = self.new_rows(users)
+        if rows:
+            self.db.session.execute(self.insert_missing(), rows)
+
+    def recreate(self, user):
+        """
+        The cache or cookie said the user's row existed but an UPDATE found
+        none: drop the stale profile and INSERT OR IGNORE the row in the
+        current transaction.
+        """
+        self.forget(user.id)
+        user._known = None
+        self.ensure_many([(user.id, user.created_at)])
+
+    def insert_missing(self):
+        return sqlite_insert(self.users).on_conflict_do_nothing()
+
+    def new_rows(self, users):
+        return [
+            {
+                "id": uid,
+                "name": self.default_name(uid) if self.default_name else None,
+                "created_at": created_at or datetime.utcnow(),
+                "total_co2": 0.0,
+            }
+            for uid, created_at in users
+        ]
+
+    def written(self, user_id, total_co2):
+        """Record the total after a committed write."""
+        known = self.cache.get(user_id)
+        if isinstance(known, Known):
+            self.cache.set(user_id, known._replace(total_co2=total_co2))
+        else:
+            self.cache.delete(user_id)  # name/created_at are loaded on the next read
+        user = self._request_user(user_id)
+        if user is not None:
+            profile_written(session, user.key, total_co2)
+
+    def forget(self, user_id):
+        self.cache.delete(user_id)
+        user = self._request_user(user_id)
+        if user is not None:
+            session.pop(f"{user.key}_profile", None)
+
+    def _request_user(self, user_id):
+        # the current request's SessionUser if it is user_id, so its cookie can follow the write
+        if not has_request_context():
+            return None  # e.g. the write-behind flusher thread
+        user = g.get("session_user")
+        return user if user is not None and user.id == user_id else None
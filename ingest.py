@@ -0,0 +1,84 @@
+"""
+Bulk write path shared by app.py and server.py.
+
+Both apps keep their own models; this module only needs the SQLAlchemy
+handle, the log model, the app's counters.TotalCounter, the user id and
+(optionally) the model used to remember idempotency keys. That model needs `user_id`, `key`,
+`rows` and `co2` columns plus a unique constraint on (user_id, key).
+"""
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+
+def _replay(db, key_model, user_id, idempotency_key):
+    seen = db.session.execute(
+        select(key_model.rows, key_model.co2).where(
+            key_model.user_id == user_id, key_model.key == idempotency_key
+        )
+    ).first()
+    if seen is None:
+        return None
+    return {"inserted": seen.rows, "total": seen.co2, "replayed": True}
+
+
+def bulk_ingest(
+    db, log_model, counter, user_id, rows, key_model=None, idempotency_key=None, before_commit=None, ensure_user=None
+):
+    """
+    Insert many log rows for one user in a single transaction.
+
+    `rows` is a list of column dicts for `log_model` (user_id and, if
+    missing, created_at are filled in). All rows go out as one executemany
+    INSERT, the user's total_co2 gets a single SQL-side increment through
+    `counter` (the user row is never loaded), and there is exactly one
+    commit. `before_commit(rows)` runs inside the same
+    transaction for derived writes such as rollups or child rows; by then
+    each row dict carries its new primary key under "id".
+
+    When an idempotency key is given and was already used by this user,
+    nothing is written and the original result is returned with
+    replayed=True, so clients can safely retry a batch.
+
+    If the increment finds no user row, `ensure_user()` is called to create
+    it in the same transaction and the increment is retried (the caller's
+    belief that the row existed came from a cache).
+
+    Returns {"inserted": int, "total": float, "replayed": bool,
+    "total_co2": the user's total after the write}.
+    """
+    if idempotency_key and key_model is not None:
+        previous = _replay(db, key_model, user_id, idempotency_key)
+        if previous:
+            return {**previous, "total_co2": counter.total(user_id)}
+
+    now = datetime.utcnow()
+    rows = [{"created_at": now, **r, "user_id": user_id} for r in rows]
+    total = sum(r["co2"] for r in rows)
+
+    try:
+        if rows:
+            ids = db.session.execute(
+                insert(log_model).returning(log_model.id, sort_by_parameter_order=True), rows
+            ).scalars()
+            for row, row_id in zip(rows, ids):
+                row["id"] = row_id
+        total_co2 = counter.add(user_id, total)
+        if total_co2 is None and ensure_user is not None:
+            ensure_user()
+            total_co2 = counter.add(user_id, total)
+        if before_commit is not None:
+            before_commit(rows)
+        if idempotency_key and key_model is not None:
+            db.session.add(key_model(user_id=user_id, key=idempotency_key, rows=len(rows), co2=total))
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent retry with the same key won the race
+        db.session.rollback()
+        previous = _replay(db, key_model, user_id, idempotency_key) if key_model is not None else None
+        if previous is None:
+            raise
+        return {**previous, "total_co2": counter.total(user_id)}
+
+    return {"inserted": len(rows), "total": total, "replayed": False, "total_co2": total_co2}
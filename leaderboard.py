@@ -0,0 +1,151 @@
+"""
+Materialized leaderboard: an in-memory sorted index of users by total_co2.
+
+The users table (with its total_co2 index) stays the source of truth. The
+index is loaded from it once, kept current by the write paths through
+`apply_delta`, and periodically reconciled against the table so that
+writes made by other worker processes (or missed deltas) converge. The
+loader runs outside the index lock: reads keep using the current index,
+and totals written while it runs are recorded and reapplied on top of the
+fresh snapshot before it is swapped in.
+
+Lookups (rank, top-N, users around someone) are bisections on a sorted
+list of (-total_co2, user_id) keys, so they cost O(log n); an update is a
+bisect plus one C-level list shift.
+"""
+import time
+import threading
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    def __init__(self, loader, reconcile_seconds=60.0):
+        """
+        loader() must return an iterable of (user_id, total_co2) pairs for
+        every user; it is called on first use and on every reconcile.
+        """
+        self.loader = loader
+        self.reconcile_seconds = reconcile_seconds
+        self._keys = []  # sorted (-total, user_id); highest total first
+        self._totals = {}  # user_id -> total
+        self._loaded_at = None
+        self._lock = threading.RLock()  # guards _keys/_totals; never held while loading
+        self._load_lock = threading.Lock()  # one load at a time
+        self._written = None  # user_id -> total set while a load runs
+        self.last_drift = 0
+
+    # ---------------------------
+    # maintenance
+    # ---------------------------
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            with self._load_lock:  # the first readers wait for the initial load
+                if self._loaded_at is None:
+                    self._reconcile()
+        elif time.monotonic() - loaded_at >= self.reconcile_seconds and self._load_lock.acquire(blocking=False):
+            # one reader refreshes; everybody else keeps reading the current index
+            try:
+                self._reconcile()
+            finally:
+                self._load_lock.release()
+
+    def reconcile(self):
+        """
+        Rebuild from the source table. Returns how many users had a total
+        that differed from the maintained index (0 when fully in sync).
+        """
+        with self._load_lock:
+            return self._reconcile()
+
+    def _reconcile(self):
+        # The loader runs without the lock, so reads and writes carry on
+        # against the current index. Totals written meanwhile are recorded
+        # and win over the snapshot, which may predate them.
+        with self._lock:
+            self._written = {}
+        try:
+            totals = {uid: float(total or 0.0) for uid, total in self.loader()}
+            keys = sorted((-total, uid) for uid, total in totals.items())
+            with self._lock:
+                maintained = self._totals.copy() if self._loaded_at is not None else None
+                written = self._written.copy()
+            if maintained is not None:
+                drift = sum(
+                    1 for uid, total in totals.items()
+                    if uid not in written and abs(maintained.get(uid, 0.0) - total) > 1e-6
+                )
+                drift += sum(1 for uid in maintained if uid not in totals and uid not in written)
+                self.last_drift = drift
+
+            with self._lock:
+                for uid, total in self._written.items():
+                    _move(keys, totals.get(uid), total, uid)
+                    totals[uid] = total
+                self._totals, self._keys = totals, keys
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._written = None
+        return self.last_drift
+
+    def set_total(self, user_id, total):
+        with self._lock:
+            if self._written is not None:
+                self._written[user_id] = total
+            if self._loaded_at is None:
+                return  # not loaded yet; the first read loads it from the table
+            _move(self._keys, self._totals.get(user_id), total, user_id)
+            self._totals[user_id] = total
+
+    def apply_delta(self, user_id, delta):
+        with self._lock:
+            if self._loaded_at is None:
+                return  # nothing to add to yet; the load reads the committed total
+            self.set_total(user_id, self._totals.get(user_id, 0.0) + delta)
+
+    # ---------------------------
+    # reads
+    # ---------------------------
+    def __len__(self):
+        self._ensure_fresh()
+        with self._lock:
+            return len(self._keys)
+
+    def top(self, n=20):
+        """[(rank, user_id, total)] for the first n users."""
+        self._ensure_fresh()
+        with self._lock:
+            return [(i + 1, uid, -neg) for i, (neg, uid) in enumerate(self._keys[:n])]
+
+    def rank(self, user_id):
+        """1-based rank of the user, or None if unknown."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._rank(user_id)
+
+    def around(self, user_id, radius=5):
+        """[(rank, user_id, total)] for up to `radius` users either side."""
+        self._ensure_fresh()
+        with self._lock:
+            rank = self._rank(user_id)
+            if rank is None:
+                return []
+            start = max(0, rank - 1 - radius)
+            window = self._keys[start : rank + radius]
+            return [(start + i + 1, uid, -neg) for i, (neg, uid) in enumerate(window)]
+
+    def _rank(self, user_id):
+        total = self._totals.get(user_id)
+        if total is None:
+            return None
+        return bisect_left(self._keys, (-total, user_id)) + 1
+
+
+def _move(keys, old, new, user_id):
+    # re-key one user in a sorted key list; old is None for a new user
+    if old is not None:
+        i = bisect_left(keys, (-old, user_id))
+        if i < len(keys) and keys[i] == (-old, user_id):
+            del keys[i]
+    insort(keys, (-new, user_id))
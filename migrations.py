@@ -0,0 +1,169 @@
+"""
+Lightweight, idempotent schema migrations for the SQLite databases.
+
+db.create_all() only creates missing tables, so anything added to an
+existing table (indexes, columns) is applied here. Every step checks that
+its table and columns exist first, which lets the same list run against
+any of the instance/*.db files whatever mix of app.py / server.py tables
+they contain.
+
+    python migrations.py                 # migrate every instance/*.db
+    python migrations.py some.db --check # migrate, then verify query plans
+"""
+import sys
+import glob
+import sqlite3
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from sqlalchemy import Date, DateTime, Float, Integer, String, column, select, table
+from sqlalchemy.dialects import sqlite
+
+from pagination import encode_cursor, keyset_query
+from rollups import ALL_CATEGORIES, board_query
+
+# (table, index name, columns)
+INDEXES = [
+    # server.py: /history, newest first
+    ("carbon_logs", "ix_carbon_logs_user_created", "user_id, created_at DESC, id DESC"),
+    ("carbon_logs", "ix_carbon_logs_user_id_desc", "user_id, id DESC"),
+    # asgi.py: /leaderboard (server.py serves it from the in-memory index)
+    ("users", "ix_users_total_co2", "total_co2"),
+    # app.py: home page and /api/logs
+    ("carbon_log", "ix_carbon_log_user_created", "user_id, created_at DESC, id DESC"),
+    ("carbon_log", "ix_carbon_log_user_id_desc", "user_id, id DESC"),
+]
+
+# (table, column, column DDL) added to tables created before the column existed
+COLUMNS = [
+    ("co2_rollups", "saved", "FLOAT NOT NULL DEFAULT 0"),
+    ("co2_rollups", "emitted", "FLOAT NOT NULL DEFAULT 0"),
+    ("carbon_rollup", "saved", "FLOAT DEFAULT 0"),
+    ("carbon_rollup", "emitted", "FLOAT DEFAULT 0"),
+    # emission_factors.json version each row was scored with (NULL = before versioning)
+    ("carbon_logs", "factor_version", "VARCHAR(20)"),
+    ("carbon_log", "factor_version", "VARCHAR(20)"),
+]
+
+# SQL-free stand-ins for the tables the hot queries read; the statements
+# below are built with the same helpers the endpoints use, so the plan check
+# follows any change to their filtering or ordering.
+def _log_table(name):
+    return table(name, column("id", Integer), column("user_id", String), column("created_at", DateTime))
+
+
+def _rollup_table(name):
+    return table(
+        name,
+        column("user_id", String),
+        column("period", String),
+        column("period_start", Date),
+        column("category", String),
+        column("co2", Float),
+        column("entries", Integer),
+    )
+
+
+def _keyset_plans(description, name, index):
+    logs = _log_table(name)
+    cursor = encode_cursor(SimpleNamespace(created_at=datetime(2024, 1, 1), id=1))
+    by_user = select(logs).where(logs.c.user_id == "x")
+    return [
+        (f"{description}, first page", name, keyset_query(by_user, logs.c), index),
+        (f"{description}, before=", name, keyset_query(by_user, logs.c, before=cursor), index),
+        (f"{description}, after=", name, keyset_query(by_user, logs.c, after=cursor), index),
+    ]
+
+
+def _board_plan(description, name, index):
+    rollups = _rollup_table(name).c
+    return (description, name, board_query(rollups, "week", date(2024, 1, 1), ALL_CATEGORIES), index)
+
+
+# (description, table, statement, index the plan must use). /leaderboard
+# without a window is served from the in-memory index (leaderboard.py).
+QUERY_PLANS = [
+    *_keyset_plans("server /history and home", "carbon_logs", "ix_carbon_logs_user_created"),
+    *_keyset_plans("app /api/logs and home", "carbon_log", "ix_carbon_log_user_created"),
+    _board_plan("server /leaderboard?window=", "co2_rollups", "ix_co2_rollups_board"),
+    _board_plan("app /api/leaderboard", "carbon_rollup", "ix_carbon_rollup_board"),
+]
+
+
+def _sql(statement):
+    return str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def _runner(connection):
+    # accepts a SQLAlchemy Connection or a plain sqlite3 connection
+    return getattr(connection, "exec_driver_sql", None) or connection.execute
+
+
+def table_columns(connection, table):
+    run = _runner(connection)
+    return {row[1] for row in run(f'PRAGMA table_info("{table}")')}
+
+
+def _index_columns(columns):
+    return [c.split()[0] for c in columns.split(",")]
+
+
+def migrate(connection):
+    """
+    Apply every step whose table exists. Returns the names of the columns
+    added and the indexes that were checked/created.
+    """
+    run = _runner(connection)
+    applied = []
+    for table, column, ddl in COLUMNS:
+        existing = table_columns(connection, table)
+        if existing and column not in existing:
+            run(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+            applied.append(f"{table}.{column}")
+    for table, name, columns in INDEXES:
+        existing = table_columns(connection, table)
+        if not existing or not set(_index_columns(columns)) <= existing:
+            continue
+        run(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns})')
+        applied.append(name)
+    return applied
+
+
+def check_query_plans(connection):
+    """
+    Run EXPLAIN QUERY PLAN for the hot read queries. Returns a list of
+    problems (empty when every query uses its index); queries on tables
+    missing from this database are skipped.
+    """
+    run = _runner(connection)
+    problems = []
+    for description, name, statement, index in QUERY_PLANS:
+        if not table_columns(connection, name):
+            continue
+        plan = " | ".join(row[-1] for row in run(f"EXPLAIN QUERY PLAN {_sql(statement)}"))
+        if index not in plan or "TEMP B-TREE" in plan:
+            problems.append(f"{description}: expected {index}, got: {plan}")
+    return problems
+
+
+def main(argv):
+    check = "--check" in argv
+    paths = [a for a in argv if not a.startswith("--")] or sorted(glob.glob("instance/*.db"))
+    failed = False
+    for path in paths:
+        connection = sqlite3.connect(path)
+        try:
+            with connection:
+                applied = migrate(connection)
+            print(f"✅ {path}: {', '.join(applied) or 'nothing to do'}")
+            if check:
+                for problem in check_query_plans(connection):
+                    failed = True
+                    print(f"❌ {path}: {problem}")
+        finally:
+            connection.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
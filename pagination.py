@@ -0,0 +1,88 @@
+"""
+Keyset (cursor) pagination over log tables, newest first.
+
+Rows are ordered by (created_at DESC, id DESC) and a cursor is the opaque
+encoding of one row's (created_at, id). Pages are fetched with a row-value
+comparison against the cursor, so SQLite seeks straight into the
+(user_id, created_at DESC, id DESC) index instead of skipping over an
+OFFSET.
+"""
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(row):
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, id); raises ValueError on a malformed cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def parse_page_args(args):
+    """
+    Reads ?limit=&before=&after= from request args.
+    Returns (limit, before, after); raises ValueError on bad input.
+    """
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    before, after = args.get("before"), args.get("after")
+    if before and after:
+        raise ValueError("use either before or after, not both")
+    return max(1, min(limit, MAX_LIMIT)), before, after
+
+
+def keyset_page(query, model, limit=DEFAULT_LIMIT, before=None, after=None):
+    """
+    One page of `query` (already filtered, e.g. by user) ordered newest first.
+
+    - no cursor: the newest `limit` rows
+    - before=<cursor>: the `limit` rows just older than the cursor
+    - after=<cursor>: the `limit` rows just newer than the cursor
+
+    Returns (rows, next_cursor). next_cursor continues in the same
+    direction and is None once there is nothing more to fetch.
+    """
+    rows = keyset_query(query, model, limit, before, after).all()
+    return page_of(rows, limit, after)
+
+
+def keyset_query(query, columns, limit=DEFAULT_LIMIT, before=None, after=None):
+    """
+    keyset_page's filtering and ordering, for an ORM query or a Core
+    select(); `columns` is the model or table.c. Fetch the rows yourself
+    and pass them to page_of().
+    """
+    key = tuple_(columns.created_at, columns.id)
+    if after:
+        query = query.where(key > tuple_(*decode_cursor(after))).order_by(columns.created_at.asc(), columns.id.asc())
+    else:
+        if before:
+            query = query.where(key < tuple_(*decode_cursor(before)))
+        query = query.order_by(columns.created_at.desc(), columns.id.desc())
+    return query.limit(limit + 1)
+
+
+def page_of(rows, limit, after=None):
+    """(rows, next_cursor) from the limit + 1 rows keyset_query fetched."""
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]) if has_more else None
+    if after:
+        rows.reverse()
+    return rows, next_cursor
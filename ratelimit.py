@@ -0,0 +1,199 @@
+"""
+Token-bucket rate limiting for write endpoints.
+
+Each (route, client) pair has a bucket holding up to `burst` tokens that
+refills at `rate` tokens per second; a request takes one token or is
+answered 429 with a Retry-After header saying when the next token will be
+there. Limits are configured per route name:
+
+    app.config["RATE_LIMITS"] = {"chat": (1.0, 5)}   # 1/s sustained, bursts of 5
+
+    limiter = RateLimiter(make_limiter_backend(app.config), app.config["RATE_LIMITS"], key=client_address)
+
+    @app.route("/chat", methods=["POST"])
+    @limiter.limit("chat")
+    def chat(): ...
+
+Bucket state lives in a backend, not in the client's cookie:
+
+- MemoryBuckets: a dict of (tokens, updated) pairs per process.
+- SQLiteBuckets: one small row per bucket in a local SQLite file, so all
+  worker processes on a host share the same buckets.
+
+A bucket that has been idle long enough to refill completely is the same
+as no bucket at all, so both backends evict those instead of keeping one
+entry per client forever.
+"""
+import math
+import time
+import sqlite3
+import functools
+import threading
+from collections import OrderedDict
+
+from flask import jsonify
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(float(burst), tokens + max(0.0, now - updated) * rate)
+
+
+def spend(state, now, rate, burst, cost=1.0):
+    """
+    One token-bucket step. `state` is (tokens, updated) or None for a full
+    bucket. Returns (new state, seconds to wait; 0.0 when allowed).
+    """
+    tokens = float(burst) if state is None else refill(state[0], state[1], now, rate, burst)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / rate
+
+
+def retry_after_seconds(wait):
+    # Retry-After takes whole seconds; never tell a client to retry "now"
+    return max(1, math.ceil(wait))
+
+
+class MemoryBuckets:
+    def __init__(self, idle_seconds=60.0, max_entries=100000):
+        self.idle_seconds = idle_seconds
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # key -> (tokens, updated), least recently used first
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def take(self, key, rate, burst, cost=1.0):
+        now = time.monotonic()
+        with self._lock:
+            state, wait = spend(self._buckets.get(key), now, rate, burst, cost)
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            self._calls += 1
+            if self._calls % 1000 == 0 or len(self._buckets) > self.max_entries:
+                self._evict(now)
+            return wait
+
+    def _evict(self, now):
+        # oldest first: stop at the first bucket that was used recently
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.idle_seconds and len(self._buckets) <= self.max_entries:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBuckets:
+    """MemoryBuckets' interface on a SQLite file shared by every process that opens it."""
+
+    def __init__(self, path, idle_seconds=60.0):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self._local = threading.local()
+        self._calls = 0
+        self._db().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL) WITHOUT ROWID"
+        )
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")  # losing a bucket only forgives a few requests
+            self._local.db = db
+        return db
+
+    def take(self, key, rate, burst, cost=1.0):
+        db = self._db()
+        now = time.time()  # wall clock: shared between processes
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            state = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            state, wait = spend(state, now, rate, burst, cost)
+            db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, state[0], state[1]))
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self._evict(now)
+        return wait
+
+    def _evict(self, now):
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM buckets WHERE updated < ?", (now - self.idle_seconds,))
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def clear(self):
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM buckets")
+
+
+def make_limiter_backend(config):
+    """
+    RATE_LIMIT_BACKEND = "memory" (default, per process) or "sqlite"
+    (shared by all workers through RATE_LIMIT_PATH). Buckets are evicted
+    once idle for as long as the slowest configured bucket takes to refill.
+    """
+    kind = config.get("RATE_LIMIT_BACKEND", "memory")
+    limits = config.get("RATE_LIMITS") or {}
+    idle = max([burst / rate for rate, burst in limits.values()] or [60.0])
+    if kind == "sqlite":
+        return SQLiteBuckets(config.get("RATE_LIMIT_PATH", "rate_limits.db"), idle)
+    if kind == "memory":
+        return MemoryBuckets(idle, config.get("RATE_LIMIT_MAX_ENTRIES", 100000))
+    raise ValueError(f"unknown RATE_LIMIT_BACKEND: {kind}")
+
+
+class RateLimiter:
+    def __init__(self, backend, limits, key):
+        """
+        `limits` maps route names to (rate per second, burst); routes missing
+        from it are not limited. `key()` identifies the client of the
+        current request.
+        """
+        self.backend = backend
+        self.limits = limits
+        self.key = key
+
+    def check(self, name, client=None):
+        """
+        Seconds until the client (default: key()) may call `name` again;
+        0.0 when the call is allowed now.
+        """
+        limit = self.limits.get(name)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        return self.backend.take(f"{name}|{client or self.key()}", rate, burst)
+
+    def limit(self, name):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                wait = self.check(name)
+                if wait > 0:
+                    return self.rejected(wait)
+                return view(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    def rejected(wait):
+        retry_after = retry_after_seconds(wait)
+        response = jsonify({"ok": False, "error": f"Too many requests. Try again in {retry_after}s."})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(retry_after)
+        return response
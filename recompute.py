@@ -0,0 +1,119 @@
+"""
+Offline re-scoring of stored logs after emission_factors.json changes.
+
+Shared by app.py and server.py (`flask --app <app> recompute`). The job
+walks the log table in primary-key chunks, reading only the columns the
+app's scorer needs, and by default only rows whose factor_version differs
+from the current table. Each chunk goes to `score_batch`, which scores
+the whole chunk column-wise and returns one update dict per row. The dicts
+are written back with a single executemany UPDATE, and the chunk is
+committed together with a checkpoint, so an interrupted run resumes after
+the last committed id. User totals are rebuilt at the end from one
+GROUP BY over the log table.
+"""
+import os
+import json
+import time
+
+from sqlalchemy import bindparam, func, or_, select, update
+
+
+def load_checkpoint(path, version):
+    """Last committed id of an unfinished run for `version`, else 0."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return state["last_id"] if state.get("version") == version else 0
+
+
+def save_checkpoint(path, version, last_id, done):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "last_id": last_id, "done": done}, f)
+    os.replace(tmp, path)  # never leaves a half-written checkpoint
+
+
+def rebuild_totals(db, log_model, user_model):
+    """users.total_co2 = SUM(co2) of the user's logs, from one aggregate pass."""
+    logs = log_model.__table__
+    users = user_model.__table__
+    sums = db.session.execute(select(logs.c.user_id, func.sum(logs.c.co2)).group_by(logs.c.user_id)).all()
+    db.session.execute(update(users).values(total_co2=0.0))
+    if sums:
+        db.session.execute(
+            update(users).where(users.c.id == bindparam("uid")).values(total_co2=bindparam("total")),
+            [{"uid": uid, "total": total or 0.0} for uid, total in sums],
+        )
+    db.session.commit()
+    return len(sums)
+
+
+def recompute(
+    db,
+    log_model,
+    user_model,
+    columns,
+    score_batch,
+    version,
+    batch_size=2000,
+    checkpoint=None,
+    everything=False,
+    after_batch=None,
+    rebuild=None,
+    log=print,
+):
+    """
+    Re-score `log_model` rows and rebuild the user totals.
+
+    `columns` are the log column names `score_batch(rows)` reads ("id" is
+    always fetched). It must return one dict per row, holding "id" plus the
+    new column values, with the same keys in every dict. `after_batch(rows,
+    updates)` runs in the chunk's transaction for derived rows. With
+    `everything` rows already on `version` are re-scored too. `rebuild()`
+    replaces the final rebuild_totals() call (e.g. TotalCounter.rebuild,
+    which also drops sharded counters).
+
+    Returns {"rows": int, "seconds": float, "rows_per_sec": float}.
+    """
+    table = log_model.__table__
+    selected = [table.c.id] + [table.c[name] for name in columns if name != "id"]
+    last_id = load_checkpoint(checkpoint, version) if checkpoint else 0
+    if last_id:
+        log(f"  resuming after id {last_id}")
+
+    done, started = 0, time.perf_counter()
+    statement = None
+    while True:
+        query = select(*selected).where(table.c.id > last_id)
+        if not everything:
+            query = query.where(or_(table.c.factor_version.is_(None), table.c.factor_version != version))
+        rows = db.session.execute(query.order_by(table.c.id).limit(batch_size)).all()
+        if not rows:
+            break
+
+        updates = score_batch(rows)
+        if statement is None:
+            names = [name for name in updates[0] if name != "id"]
+            statement = update(table).where(table.c.id == bindparam("b_id")).values(
+                {name: bindparam(f"b_{name}") for name in names}
+            )
+        db.session.execute(statement, [{f"b_{k}": v for k, v in u.items()} for u in updates])
+        if after_batch is not None:
+            after_batch(rows, updates)
+        db.session.commit()
+
+        last_id = rows[-1].id
+        done += len(rows)
+        if checkpoint:
+            save_checkpoint(checkpoint, version, last_id, done)
+        elapsed = time.perf_counter() - started
+        log(f"  re-scored {done} logs (last id {last_id}, {done / elapsed:.0f} rows/s)")
+
+    users = rebuild() if rebuild is not None else rebuild_totals(db, log_model, user_model)
+    elapsed = time.perf_counter() - started
+    log(f"  rebuilt totals for {users} users")
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return {"rows": done, "seconds": elapsed, "rows_per_sec": done / elapsed if elapsed else 0.0}
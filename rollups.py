@@ -0,0 +1,159 @@
+"""
+Pre-aggregated CO₂ rollups per (user, period, period start, category).
+
+Every log insert also upserts its contribution into the rollup table for
+each period kind (day / week / month / all-time), both under its own
+category and under the "*" (all categories) row. A windowed leaderboard
+page is then a single index range scan:
+
+    WHERE period = ? AND period_start = ? AND category = ?
+    ORDER BY co2 DESC LIMIT ?
+
+instead of a GROUP BY over the whole log table.
+
+The rollup model (one per app) needs user_id, period, period_start,
+category, co2, saved, emitted and entries columns, with (user_id, period,
+period_start, category) as its primary key. `co2` is the net value
+(saved - emitted); `saved` and `emitted` are both positive magnitudes.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+PERIODS = ("day", "week", "month", "all")
+ALL_CATEGORIES = "*"
+EPOCH = date(1970, 1, 1)  # period_start of the all-time rollup
+
+
+def period_start(period, when):
+    day = when.date() if isinstance(when, datetime) else when
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())  # Monday
+    if period == "month":
+        return day.replace(day=1)
+    if period == "all":
+        return EPOCH
+    raise ValueError(f"unknown period: {period}")
+
+
+def rollup_rows(events):
+    """
+    Aggregate (user_id, created_at, category, co2) events into rollup rows:
+    one per user/period/period_start/category, plus the "*" totals.
+    """
+    acc = {}
+    for user_id, created_at, category, co2 in events:
+        for period in PERIODS:
+            start = period_start(period, created_at)
+            for cat in {category or "unknown", ALL_CATEGORIES}:
+                key = (user_id, period, start, cat)
+                row = acc.setdefault(key, [0.0, 0.0, 0.0, 0])
+                row[0] += co2
+                if co2 > 0:
+                    row[1] += co2
+                else:
+                    row[2] -= co2
+                row[3] += 1
+    return [
+        {
+            "user_id": u,
+            "period": p,
+            "period_start": s,
+            "category": c,
+            "co2": co2,
+            "saved": saved,
+            "emitted": emitted,
+            "entries": n,
+        }
+        for (u, p, s, c), (co2, saved, emitted, n) in acc.items()
+    ]
+
+
+def add_to_rollups(db, rollup_model, events):
+    """
+    Upsert the events' contribution in the current transaction (the caller
+    commits, together with the log rows themselves).
+    """
+    rows = rollup_rows(events)
+    if not rows:
+        return 0
+    db.session.execute(rollup_upsert(rollup_model.__table__), rows)
+    return len(rows)
+
+
+def rollup_upsert(table):
+    """INSERT ... ON CONFLICT DO UPDATE adding a rollup_rows() row onto the stored one."""
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.period, table.c.period_start, table.c.category],
+        set_={
+            name: table.c[name] + stmt.excluded[name] for name in ("co2", "saved", "emitted", "entries")
+        },
+    )
+
+
+def parse_window_args(args):
+    """
+    Reads ?window=day|week|month|all&category=&date=YYYY-MM-DD.
+    Returns (period, period_start, category); raises ValueError.
+    """
+    period = args.get("window", "all")
+    if period not in PERIODS:
+        raise ValueError(f"window must be one of: {', '.join(PERIODS)}")
+    try:
+        when = date.fromisoformat(args["date"]) if args.get("date") else datetime.utcnow().date()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD")
+    return period, period_start(period, when), args.get("category") or ALL_CATEGORIES
+
+
+def top_users(db, rollup_model, period, start, category=ALL_CATEGORIES, limit=20, offset=0):
+    """[(rank, user_id, co2, entries)] for one board page, highest saved first."""
+    rows = db.session.execute(board_query(rollup_model, period, start, category, limit, offset))
+    return ranked(rows, offset)
+
+
+def board_query(columns, period, start, category=ALL_CATEGORIES, limit=20, offset=0):
+    """top_users' SELECT; `columns` is the rollup model or its table.c."""
+    return (
+        select(columns.user_id, columns.co2, columns.entries)
+        .where(columns.period == period, columns.period_start == start, columns.category == category)
+        .order_by(columns.co2.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+
+
+def ranked(rows, offset=0):
+    return [(offset + i + 1, r.user_id, r.co2, r.entries) for i, r in enumerate(rows)]
+
+
+def backfill(db, log_model, rollup_model, to_events, batch_size=5000, log=print):
+    """
+    Rebuild the rollup table from existing logs, walking the log table in
+    primary-key batches and committing once per batch.
+    `to_events(log_row)` yields (user_id, created_at, category, co2).
+    """
+    db.session.query(rollup_model).delete()
+    db.session.commit()
+
+    last_id, done = 0, 0
+    while True:
+        batch = (
+            log_model.query.filter(log_model.id > last_id)
+            .order_by(log_model.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        add_to_rollups(db, rollup_model, [e for row in batch for e in to_events(row)])
+        db.session.commit()
+        last_id = batch[-1].id
+        done += len(batch)
+        db.session.expunge_all()
+        log(f"  rolled up {done} logs (last id {last_id})")
+    return done
@@ -0,0 +1,152 @@
+"""
+Vectorized scoring of parsed items (app.py's compute_item over columns).
+
+Items are turned into columns once: an activity id, the quantity, a unit
+code and quantity_kg (NaN when unknown). The CO₂ of the whole batch is
+then a handful of NumPy operations against vectors precomputed from the
+factor table:
+
+    rate = km_rate[id] | electricity | food_rate[id]   (by unit code)
+    base = quantity | quantity_kg or quantity * default serving
+    co2  = -base * rate
+
+which is the same floating-point expression compute_item evaluates, so
+the values are identical. The one place float64 columns can differ is
+the sign of a zero: compute_item negates an int zero to +0, so zero
+results are recomputed with its own Python expression. `values()` also
+hands back an int where compute_item would (an int quantity times an int factor), so stored JSON
+does not change either. Explanation strings are only formatted when asked
+for.
+
+    engine = get_engine()              # built once per factor table
+    batch = engine.batch(items)
+    batch.co2                          # numpy array
+    batch.values(), batch.explain(i)
+"""
+import math
+
+import numpy as np
+
+import factors
+
+UNIT_KM, UNIT_KWH, UNIT_MASS = 0, 1, 2  # "mass" = anything compute_item scores as food
+UNIT_CODES = {"km": UNIT_KM, "kwh": UNIT_KWH}
+
+# compute_item's fallbacks for activities missing from the table
+DEFAULT_KM_FACTOR = 0.2
+DEFAULT_FOOD_FACTOR = 6
+DEFAULT_SERVING_KG = factors.SERVING_WEIGHTS["default"]
+
+
+class ScoringEngine:
+    def __init__(self, table):
+        self.version = table.version
+        self.activities = table.keys()
+        self.ids = {key: i for i, key in enumerate(self.activities)}
+        self.unknown_id = len(self.activities)
+
+        # per-activity rates for the km and food branches; the last slot is
+        # the fallback for unknown activities
+        values = [table.factors[key] for key in self.activities]
+        self.km_rate = np.array(values + [DEFAULT_KM_FACTOR], dtype=np.float64)
+        self.food_rate = np.array(values + [DEFAULT_FOOD_FACTOR], dtype=np.float64)
+        self.km_rate_is_int = np.array([type(v) is int for v in values] + [False])
+        self.food_rate_is_int = np.array([type(v) is int for v in values] + [True])
+        self.km_values = values + [DEFAULT_KM_FACTOR]  # the same rates as Python numbers
+        self.food_values = values + [DEFAULT_FOOD_FACTOR]
+        self.electricity = table.factors["electricity"]
+        self.electricity_is_int = type(self.electricity) is int
+
+    def activity_id(self, activity):
+        return self.ids.get(activity, self.unknown_id)
+
+    def score(self, activity_ids, quantities, unit_codes, quantities_kg=None):
+        """
+        CO₂ array for columnar input. quantities_kg may be None or contain
+        NaN where compute_item would fall back to a default serving.
+        """
+        ids = np.asarray(activity_ids, dtype=np.intp)
+        qty = np.asarray(quantities, dtype=np.float64)
+        units = np.asarray(unit_codes, dtype=np.int8)
+        qkg = np.full(qty.shape, np.nan) if quantities_kg is None else np.asarray(quantities_kg, dtype=np.float64)
+
+        rate = np.where(
+            units == UNIT_KM, self.km_rate[ids], np.where(units == UNIT_KWH, self.electricity, self.food_rate[ids])
+        )
+        base = np.where(units == UNIT_MASS, np.where(np.isnan(qkg), qty * DEFAULT_SERVING_KG, qkg), qty)
+        return -base * rate
+
+    def batch(self, items):
+        return ItemBatch(self, items)
+
+
+class ItemBatch:
+    """Columns and scores for a list of item dicts (activity, quantity, unit, quantity_kg)."""
+
+    def __init__(self, engine, items):
+        self.engine = engine
+        self.items = items
+        self.activity_ids = np.fromiter((engine.activity_id(it["activity"]) for it in items), np.intp, len(items))
+        self.quantities = np.fromiter((it["quantity"] for it in items), np.float64, len(items))
+        self.unit_codes = np.fromiter((UNIT_CODES.get(it["unit"], UNIT_MASS) for it in items), np.int8, len(items))
+        self.quantities_kg = np.fromiter(
+            (math.nan if it.get("quantity_kg") is None else it["quantity_kg"] for it in items), np.float64, len(items)
+        )
+        self.co2 = engine.score(self.activity_ids, self.quantities, self.unit_codes, self.quantities_kg)
+        # zeros take compute_item's sign (an int zero quantity gives +0, not -0.0)
+        for i in np.flatnonzero(self.co2 == 0).tolist():
+            self.co2[i] = -self._base(i) * self._rate(i)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _base(self, i):
+        it = self.items[i]
+        if self.unit_codes[i] != UNIT_MASS:
+            return it["quantity"]
+        qkg = it.get("quantity_kg")
+        return it["quantity"] * DEFAULT_SERVING_KG if qkg is None else qkg
+
+    def _rate(self, i):
+        engine, unit = self.engine, self.unit_codes[i]
+        if unit == UNIT_KM:
+            return engine.km_values[self.activity_ids[i]]
+        if unit == UNIT_KWH:
+            return engine.electricity
+        return engine.food_values[self.activity_ids[i]]
+
+    def _is_int(self, i):
+        # compute_item returns an int when both operands are ints
+        engine, unit = self.engine, self.unit_codes[i]
+        if type(self._base(i)) is not int:
+            return False
+        if unit == UNIT_KM:
+            return bool(engine.km_rate_is_int[self.activity_ids[i]])
+        if unit == UNIT_KWH:
+            return engine.electricity_is_int
+        return bool(engine.food_rate_is_int[self.activity_ids[i]])
+
+    def value(self, i):
+        co2 = float(self.co2[i])
+        return int(co2) if self._is_int(i) else co2
+
+    def values(self):
+        return [self.value(i) for i in range(len(self.items))]
+
+    def explain(self, i):
+        """compute_item's explanation for item i, formatted on demand."""
+        it, co2, unit = self.items[i], self.value(i), self.unit_codes[i]
+        if unit == UNIT_KM:
+            return f"{it['activity']} {it['quantity']} km → {co2:.2f} kg CO₂"
+        if unit == UNIT_KWH:
+            return f"electricity {it['quantity']} kWh → {co2:.2f} kg CO₂"
+        return f"{it['activity']} {self._base(i):.2f} kg → {co2:.2f} kg CO₂"
+
+    def explanations(self):
+        return (self.explain(i) for i in range(len(self.items)))
+
+
+def get_engine(table=None):
+    """The engine for a factor table (default: the current one), built once per table."""
+    table = table or factors.current()
+    return table.derived("scoring", ScoringEngine)
@@ -1,8 +1,7 @@
 # save as app.py
-import re
-import uuid
-import time
-from datetime import datetime
+import os
+import atexit
+from datetime import datetime, timedelta
 
 from flask import (
     Flask,
@@ -13,15 +12,72 @@ from flask import (
     url_for,
     render_template_string,
 )
+import click
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert
+
+import factors
+from cache import ResponseCache, make_cache_backend
+from carbon_logic import calculate as calculate_carbon_structured, calculate_many, rescore
+from counters import TotalCounter
+from events import Broker, TooManySubscribers, event_stream, sse
+from export import filter_range, parse_export_args, stream_export
+from identity import UserDirectory
+from ingest import bulk_ingest
+from leaderboard import Leaderboard
+from migrations import migrate
+from pagination import keyset_page, parse_page_args
+from ratelimit import RateLimiter, make_limiter_backend
+from recompute import recompute
+from rollups import ALL_CATEGORIES, add_to_rollups, backfill, parse_window_args, top_users
+from sqlite_profile import apply_sqlite_profile, sqlite_engine_options
+from writebehind import WriteBehindQueue
 
 # ---------------------------
 # Basic Flask + DB setup
 # ---------------------------
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "change-this-secret-in-production"
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///carbon.db"
+# CARBON_DATABASE_URI points both apps somewhere else (the tests use a scratch file)
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("CARBON_DATABASE_URI", "sqlite:///carbon.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# write-behind: /chat queues rows and a background thread group-commits them
+app.config["WRITE_BEHIND"] = False
+app.config["WRITE_BEHIND_MAX_QUEUE"] = 10000  # /chat answers 429 when this many rows are waiting
+app.config["WRITE_BEHIND_BATCH"] = 500  # rows per group commit
+app.config["WRITE_BEHIND_INTERVAL"] = 0.05  # max seconds a row waits before a flush
+app.config["WRITE_BEHIND_MAX_RETRIES"] = 3  # then the batch is split to drop the rows that fail alone
+# the in-memory leaderboard is re-read from the users table this often
+app.config["LEADERBOARD_RECONCILE_SECONDS"] = 60
+# read responses are cached ("memory" per process, or "sqlite" shared by all
+# workers via RESPONSE_CACHE_PATH); per-user entries are dropped when the user writes
+app.config["RESPONSE_CACHE_BACKEND"] = "memory"
+app.config["RESPONSE_CACHE_PATH"] = "response_cache.db"
+app.config["RESPONSE_CACHE_TTL"] = 5  # seconds, unless a route sets its own
+app.config["STATS_CACHE_TTL"] = 10  # /stats/summary
+# how often emission_factors.json is checked for changes
+app.config["FACTORS_RELOAD_SECONDS"] = 5
+# users.total_co2 is incremented in SQL; listed hot users write to TOTAL_SHARDS
+# shard rows instead, folded into users.total_co2 every TOTAL_FOLD_SECONDS
+app.config["TOTAL_SHARDS"] = 0
+app.config["TOTAL_SHARDED_USERS"] = []
+app.config["TOTAL_FOLD_SECONDS"] = 30
+# known users and their last totals are kept in memory (refreshed on write)
+app.config["USER_CACHE_MAX_ENTRIES"] = 100000
+app.config["USER_CACHE_TTL"] = 30
+# token buckets per client address and route: (refill per second, burst);
+# "sqlite" shares the buckets between workers through RATE_LIMIT_PATH
+app.config["RATE_LIMITS"] = {"chat": (1.0, 5), "chat_bulk": (0.5, 2)}
+app.config["RATE_LIMIT_BACKEND"] = "memory"
+app.config["RATE_LIMIT_PATH"] = "rate_limits.db"
+# live updates (/events, /leaderboard/stream): writes are coalesced into at most
+# one message per stream every EVENTS_INTERVAL seconds
+app.config["EVENTS_INTERVAL"] = 1.0
+app.config["EVENTS_MAX_SUBSCRIBERS"] = 1000  # open streams per process; more get 503
+app.config["EVENTS_KEEPALIVE"] = 15  # seconds between keepalive comments
+# WAL, synchronous=NORMAL, busy_timeout etc. (see sqlite_profile.DEFAULT_PRAGMAS);
+# override with app.config["SQLITE_PRAGMAS"] / app.config["SQLITE_POOL"]
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_engine_options(app.config)
 db = SQLAlchemy(app)
 
 
@@ -33,7 +89,7 @@ class User(db.Model):
     id = db.Column(db.String(36), primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     name = db.Column(db.String(120), nullable=True)
-    total_co2 = db.Column(db.Float, default=0.0)  # positive => saved, negative => emitted
+    total_co2 = db.Column(db.Float, default=0.0, index=True)  # positive => saved, negative => emitted
 
     def to_dict(self):
         return {
@@ -53,6 +109,7 @@ class CarbonLog(db.Model):
     quantity = db.Column(db.Float, nullable=True)
     unit = db.Column(db.String(20), nullable=True)
     co2 = db.Column(db.Float, nullable=False)  # positive => saved, negative => emitted
+    factor_version = db.Column(db.String(20), nullable=True)  # emission_factors.json version used for co2
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -64,198 +121,271 @@ class CarbonLog(db.Model):
             "quantity": self.quantity,
             "unit": self.unit,
             "co2": round(self.co2, 4),
+            "factor_version": self.factor_version,
             "created_at": self.created_at.isoformat(),
         }
 
 
+# newest-first history per user; kept in sync with migrations.INDEXES
+db.Index("ix_carbon_logs_user_created", CarbonLog.user_id, CarbonLog.created_at.desc(), CarbonLog.id.desc())
+db.Index("ix_carbon_logs_user_id_desc", CarbonLog.user_id, CarbonLog.id.desc())
+
+
+class IngestKey(db.Model):
+    __tablename__ = "ingest_keys"
+    __table_args__ = (db.UniqueConstraint("user_id", "key"),)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String(36), db.ForeignKey("users.id"), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    co2 = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class CO2Rollup(db.Model):
+    """Per-user CO₂ per day/week/month/all-time and category; see rollups.py."""
+    __tablename__ = "co2_rollups"
+    __table_args__ = (
+        db.Index("ix_co2_rollups_board", "period", "period_start", "category", db.text("co2 DESC")),
+    )
+    user_id = db.Column(db.String(36), db.ForeignKey("users.id"), primary_key=True)
+    period = db.Column(db.String(10), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    co2 = db.Column(db.Float, nullable=False, default=0.0)  # net: saved - emitted
+    saved = db.Column(db.Float, nullable=False, default=0.0)
+    emitted = db.Column(db.Float, nullable=False, default=0.0)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TotalShard(db.Model):
+    """Pending total_co2 deltas of hot users; see counters.py."""
+    __tablename__ = "user_total_shards"
+    user_id = db.Column(db.String(36), db.ForeignKey("users.id"), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    co2 = db.Column(db.Float, nullable=False, default=0.0)
+
+
+def log_events(rows):
+    # (user_id, created_at, category, co2) for rollups.add_to_rollups
+    return [(r["user_id"], r["created_at"], r["category"], r["co2"]) for r in rows]
+
+
 # Create DB tables if missing
 with app.app_context():
+    apply_sqlite_profile(app, db)
     db.create_all()
+    with db.engine.begin() as connection:
+        migrate(connection)
 
 
-# ---------------------------------------
-# Emission factors and helper functions
-# ---------------------------------------
-EMISSION_FACTORS = {
-    "transport": {
-        "car": 0.20,  # kg per km
-        "motorbike": 0.10,
-        "bus": 0.05,
-        "train": 0.03,
-        "flight": 0.25,
-        "cycle": 0.0,  # savings calculated vs car
-        "walk": 0.0,
-    },
-    "energy": {
-        "electricity": 0.82,  # kg CO2e per kWh (approx India avg)
-        "lpg": 2.98,  # per kg
-        "natural_gas": 1.90,  # per m3
-    },
-    "food": {
-        "beef": 27.0,  # per kg
-        "chicken": 6.9,
-        "milk": 1.3,
-        "rice": 2.7,
-        "vegetables": 0.5,
-    },
-    "waste": {
-        "plastic": 6.0,  # per kg
-        "paper": 1.3,
-    },
-}
-
-
-def extract_quantity(text: str):
-    """
-    Try to extract a numeric quantity and a unit from the text.
-    Returns (value: float or None, unit_type: str or None, unit_raw: str or None)
-    """
-    text = text.lower()
-    # capture patterns like "12 km", "3.5 kwh", "0.2 kg", "2 m3"
-    m = re.search(r"(\d+(\.\d+)?)\s*(km|kwh|kw|kg|m3)", text)
-    if m:
-        value = float(m.group(1))
-        raw_unit = m.group(3)
-        unit_map = {"km": "km", "kwh": "kwh", "kw": "kwh", "kg": "kg", "m3": "m3"}
-        return value, unit_map.get(raw_unit, raw_unit), raw_unit
-    return None, None, None
-
-
-def calculate_carbon_structured(activity: str):
-    """
-    Improved structured carbon calculation.
-    Returns a dict:
-    {
-      activity: "car",
-      category: "transport",
-      quantity: 12,
-      unit: "km",
-      co2: -2.4,  # positive means saved, negative means emitted
-      message: "..."
-    }
-    """
-    text = (activity or "").lower().strip()
-    qty, unit_type, unit_raw = extract_quantity(text)
-    if qty is None:
-        # sensible defaults when quantity is missing for travel: assume 1 km
-        if any(w in text for w in ["car", "cycle", "bike", "walk", "bus", "train"]):
-            qty = 1.0
-            unit_type = "km"
-            unit_raw = "km"
-        else:
-            qty = 1.0  # fallback generic
-
-    # transport
-    for mode, factor in EMISSION_FACTORS["transport"].items():
-        if mode in text:
-            if mode in ["cycle", "walk"]:
-                # treated as saving vs car (assume 0.2 kg/km car saved)
-                saved = qty * EMISSION_FACTORS["transport"]["car"]
-                return {
-                    "activity": mode,
-                    "category": "transport",
-                    "quantity": qty,
-                    "unit": unit_type or "km",
-                    "co2": round(+saved, 6),
-                    "message": f"🚴 {mode.title()} {qty} {unit_raw} saved {saved:.2f} kg CO₂",
-                }
-            else:
-                emitted = qty * factor
-                return {
-                    "activity": mode,
-                    "category": "transport",
-                    "quantity": qty,
-                    "unit": unit_type or "km",
-                    "co2": round(-emitted, 6),
-                    "message": f"🚗 {mode.title()} {qty} {unit_raw} emitted {emitted:.2f} kg CO₂",
-                }
-
-    # energy
-    for source, factor in EMISSION_FACTORS["energy"].items():
-        if source in text or source.replace("_", " ") in text:
-            emitted = qty * factor
-            return {
-                "activity": source,
-                "category": "energy",
-                "quantity": qty,
-                "unit": unit_type or "kWh",
-                "co2": round(-emitted, 6),
-                "message": f"⚡ {source.title()} use {qty} {unit_raw or 'units'} emitted {emitted:.2f} kg CO₂",
-            }
+# ---------------------------
+# Running totals
+# ---------------------------
+counter = TotalCounter(
+    db,
+    User,
+    CarbonLog,
+    TotalShard,
+    shards=app.config["TOTAL_SHARDS"],
+    sharded_users=app.config["TOTAL_SHARDED_USERS"],
+    fold_seconds=app.config["TOTAL_FOLD_SECONDS"],
+)
 
-    # food
-    for food, factor in EMISSION_FACTORS["food"].items():
-        if food in text:
-            emitted = qty * factor
-            return {
-                "activity": food,
-                "category": "food",
-                "quantity": qty,
-                "unit": unit_type or "kg",
-                "co2": round(-emitted, 6),
-                "message": f"🍽️ {qty} {unit_raw or 'kg'} of {food} emitted {emitted:.2f} kg CO₂",
-            }
 
-    # waste
-    for item, factor in EMISSION_FACTORS["waste"].items():
-        if item in text:
-            emitted = qty * factor
-            return {
-                "activity": item,
-                "category": "waste",
-                "quantity": qty,
-                "unit": unit_type or "kg",
-                "co2": round(-emitted, 6),
-                "message": f"🗑️ Disposing {qty} {unit_raw or 'kg'} of {item} emitted {emitted:.2f} kg CO₂",
-            }
+user_directory = UserDirectory(
+    db,
+    User,
+    counter,
+    max_entries=app.config["USER_CACHE_MAX_ENTRIES"],
+    ttl=app.config["USER_CACHE_TTL"],
+)
+
 
-    # fallback: couldn't identify specific category
+def user_payload(user):
+    # User.to_dict() for the session user, served from the user directory
     return {
-        "activity": "unknown",
-        "category": "unknown",
-        "quantity": qty,
-        "unit": unit_type or "",
-        "co2": 0.0,
-        "message": "🤔 Could not determine activity. Try phrases like 'drove 5 km', 'cycled 3 km', or 'used 2 kWh electricity'.",
+        "id": user.id,
+        "name": user.name or f"User-{user.id[:6]}",
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+        "total_co2": round(user.total_co2, 4),
     }
 
 
+# ---------------------------
+# Materialized leaderboard
+# ---------------------------
+leaderboard_index = Leaderboard(counter.totals, reconcile_seconds=app.config["LEADERBOARD_RECONCILE_SECONDS"])
+
+
+# ---------------------------
+# Response cache
+# ---------------------------
+responses = ResponseCache(make_cache_backend(app.config))
+
+
+def session_user_id():
+    # cache key owner; read from the cookie so a cache hit needs no DB round trip
+    return session.get("user_id")
+
+
+def user_written(user_id):
+    """
+    Called when a user's logs change: drop every response cached from that
+    user's data.
+    """
+    responses.invalidate_user(user_id)
+
+
 # ---------------------------
 # Simple session user helpers
 # ---------------------------
-def get_or_create_session_user():
+def session_user():
     """
-    Use Flask session to establish an anonymous user id and persist a User row.
+    The anonymous user of this request's session (see identity.py). No
+    query is made to resolve it; the User row is created by the first write.
     """
-    user_id = session.get("user_id")
-    if not user_id:
-        user_id = str(uuid.uuid4())
-        session["user_id"] = user_id
-        # optional: store when created
-    user = User.query.get(user_id)
-    if not user:
-        user = User(id=user_id, name=None, total_co2=0.0)
-        db.session.add(user)
+    return user_directory.current("user_id")
+
+
+# ---------------------------
+# Write-behind log ingestion
+# ---------------------------
+_write_queue = None
+
+
+def write_log_batch(batch):
+    """
+    Group commit for the write-behind queue: one INSERT for every queued
+    log row and one executemany UPDATE for the per-user total deltas.
+    """
+    deltas = {}
+    for user_id, _, co2 in batch:
+        deltas[user_id] = deltas.get(user_id, 0.0) + co2
+
+    rows = [row for _, row, _ in batch]
+    with app.app_context():
+        user_directory.ensure_many([(uid, None) for uid in deltas])
+        db.session.execute(insert(CarbonLog), rows)
+        add_to_rollups(db, CO2Rollup, log_events(rows))
+        counter.add_many(deltas)
         db.session.commit()
-    return user
+
+    # The rows are committed from here on: a failure below must not reach
+    # the queue, or it would retry the batch and insert them a second time.
+    for uid, delta in deltas.items():
+        try:
+            leaderboard_index.apply_delta(uid, delta)
+            user_directory.forget(uid)
+            user_written(uid)
+        except Exception:
+            app.logger.exception("post-commit update for user %s failed", uid)
+    try:
+        broker.touch("leaderboard")
+    except Exception:
+        app.logger.exception("leaderboard invalidation after write-behind flush failed")
+
+
+def get_write_queue():
+    """
+    The shared write-behind queue, or None when WRITE_BEHIND is off.
+    """
+    global _write_queue
+    if not app.config["WRITE_BEHIND"]:
+        return None
+    if _write_queue is None:
+        _write_queue = WriteBehindQueue(
+            write_log_batch,
+            max_size=app.config["WRITE_BEHIND_MAX_QUEUE"],
+            batch_size=app.config["WRITE_BEHIND_BATCH"],
+            interval=app.config["WRITE_BEHIND_INTERVAL"],
+            max_retries=app.config["WRITE_BEHIND_MAX_RETRIES"],
+            logger=app.logger,
+        )
+        atexit.register(_write_queue.stop)
+    return _write_queue
+
+
+def wait_for_own_writes(user):
+    # reads flush the user's queued rows first so they always see their own writes
+    queue = get_write_queue()
+    if queue is not None:
+        queue.wait_for(user.id)
+
+
+# ---------------------------
+# Rate limiting
+# ---------------------------
+def client_address():
+    # not the session: a client could drop the cookie to get a fresh bucket
+    # (behind a reverse proxy, wrap app.wsgi_app in werkzeug's ProxyFix)
+    return request.remote_addr or "unknown"
+
+
+limiter = RateLimiter(make_limiter_backend(app.config), app.config["RATE_LIMITS"], key=client_address)
 
 
 # ---------------------------
-# Simple rate limiter (per session)
+# Live updates (Server-Sent Events)
 # ---------------------------
-def rate_limit_ok():
-    last = session.get("last_submission_at", 0)
-    now = time.time()
-    # allow 1 req / second per session
-    if now - last < 1.0:
-        return False
-    session["last_submission_at"] = now
-    return True
+broker = Broker(
+    interval=app.config["EVENTS_INTERVAL"],
+    max_subscribers=app.config["EVENTS_MAX_SUBSCRIBERS"],
+    logger=app.logger,
+)
+
+
+def render_leaderboard():
+    # runs on the broker's flusher thread at most once per interval
+    with app.app_context():
+        return ranked_users(leaderboard_index.top(20))
+
+
+# re-rendered on every write, and each reconcile period for other workers' writes
+broker.board("leaderboard", render_leaderboard, refresh_seconds=app.config["LEADERBOARD_RECONCILE_SECONDS"])
+
+
+def publish_write(user_id, total, logs):
+    """Tell the user's open streams (and the leaderboard) about committed or queued logs."""
+    topic = f"user:{user_id}"
+    for log in logs:
+        broker.append(topic, "log", log)
+    broker.publish(topic, "total", {"total_co2": round(total, 4)})
+    broker.touch("leaderboard")
+
+
+def live_stream(topics, first_frames):
+    """
+    Subscribe before first_frames() reads the snapshot, so a write landing
+    in between is sent rather than lost (clients drop logs they already have).
+    """
+    try:
+        sub = broker.subscribe(topics)
+    except TooManySubscribers:
+        return jsonify({"ok": False, "error": "Too many live connections. Try again shortly."}), 503
+    try:
+        first = first_frames()
+    except Exception:
+        broker.unsubscribe(sub)
+        raise
+    return event_stream(broker, sub, first, app.config["EVENTS_KEEPALIVE"])
 
 
 # ---------------------------
 # Routes
 # ---------------------------
+@app.before_request
+def refresh_factors():
+    # picks up edits to emission_factors.json without a restart
+    factors.reload_if_changed(app.config["FACTORS_RELOAD_SECONDS"])
+
+
+@app.before_request
+def fold_total_shards():
+    # no-op unless TOTAL_SHARDS is on
+    counter.fold_if_due()
+
+
 INDEX_HTML = """
 <!doctype html>
 <html>
@@ -291,23 +421,25 @@ INDEX_HTML = """
         body: JSON.stringify({ prompt })
       });
       const json = await res.json();
-      document.getElementById('out').innerText = json.message;
-      await loadStats();
-      await loadLogs();
+      document.getElementById('out').innerText = json.message || json.error;
     }
-    async function loadStats(){
-      const r = await fetch('/stats');
-      const j = await r.json();
-      document.getElementById('stats').innerText = JSON.stringify(j, null, 2);
-    }
-    async function loadLogs(){
-      const r = await fetch('/history');
-      const j = await r.json();
-      document.getElementById('logs').innerText = JSON.stringify(j, null, 2);
+
+    // stats and logs are pushed by /events (no polling); a reconnect starts with a fresh snapshot
+    let stats = {}, logs = [];
+    function render(){
+      document.getElementById('stats').innerText = JSON.stringify(stats, null, 2);
+      document.getElementById('logs').innerText = JSON.stringify(logs, null, 2);
     }
-    // bootstrap
-    loadStats();
-    loadLogs();
+    const events = new EventSource('/events');
+    events.addEventListener('stats', e => { stats = JSON.parse(e.data); render(); });
+    events.addEventListener('history', e => { logs = JSON.parse(e.data).items; render(); });
+    events.addEventListener('total', e => { stats.total_co2 = JSON.parse(e.data).total_co2; render(); });
+    events.addEventListener('log', e => {
+      const seen = new Set(logs.map(l => l.id));
+      const fresh = JSON.parse(e.data).filter(l => l.id == null || !seen.has(l.id)).reverse();
+      logs = fresh.concat(logs).slice(0, 20);
+      render();
+    });
   </script>
 </body>
 </html>
@@ -316,17 +448,15 @@ INDEX_HTML = """
 
 @app.route("/")
 def home():
-    # ensure session user exists
-    get_or_create_session_user()
+    # hands out the session user id; the row is created on the first write
+    session_user()
     return render_template_string(INDEX_HTML)
 
 
 @app.route("/chat", methods=["POST"])
+@limiter.limit("chat")
 def chat():
-    if not rate_limit_ok():
-        return jsonify({"ok": False, "error": "Too many requests. Try again in a second."}), 429
-
-    user = get_or_create_session_user()
+    user = session_user()
     data = request.get_json() or {}
     prompt = (data.get("prompt") or "").strip()
     if not prompt:
@@ -334,6 +464,39 @@ def chat():
 
     calc = calculate_carbon_structured(prompt)
 
+    queue = get_write_queue()
+    if queue is not None:
+        row = {
+            "user_id": user.id,
+            "activity": prompt,
+            "category": calc["category"],
+            "quantity": calc["quantity"],
+            "unit": calc["unit"],
+            "co2": calc["co2"],
+            "factor_version": calc["factor_version"],
+            "created_at": datetime.utcnow(),
+        }
+        if not queue.submit(user.id, row, calc["co2"]):
+            return jsonify({"ok": False, "error": "Server busy. Try again shortly."}), 429
+        # a cache miss makes the next read wait for the flush
+        user_written(user.id)
+        # the committed total plus everything of this user still in the queue
+        projected = (user.total_co2 or 0.0) + queue.pending_delta(user.id)
+        # the total cached for this user (and in their session cookie) is behind now
+        user_directory.forget(user.id)
+        log = CarbonLog(**row).to_dict()
+        publish_write(user.id, projected, [log])
+        return jsonify(
+            {
+                "ok": True,
+                "message": calc["message"],
+                "co2": calc["co2"],
+                "total_co2": round(projected, 6),
+                "log": log,
+                "queued": True,
+            }
+        )
+
     # Persist the log and update user's total_co2
     log = CarbonLog(
         user_id=user.id,
@@ -342,41 +505,343 @@ def chat():
         quantity=calc["quantity"],
         unit=calc["unit"],
         co2=calc["co2"],
+        factor_version=calc["factor_version"],
+        created_at=datetime.utcnow(),
     )
+    user_directory.ensure(user)
     db.session.add(log)
-    # update user's total
-    user.total_co2 = (user.total_co2 or 0.0) + calc["co2"]
+    add_to_rollups(db, CO2Rollup, [(user.id, log.created_at, log.category, log.co2)])
+    # update user's total in SQL, in the same transaction (no read-modify-write)
+    total = counter.add(user.id, calc["co2"])
+    if total is None:  # the cached profile was stale: the row is gone
+        user_directory.recreate(user)
+        total = counter.add(user.id, calc["co2"])
     db.session.commit()
+    user_directory.written(user.id, total)
+    leaderboard_index.set_total(user.id, total)
+    user_written(user.id)
+    publish_write(user.id, total, [log.to_dict()])
 
     response_payload = {
         "ok": True,
         "message": calc["message"],
         "co2": calc["co2"],
-        "total_co2": round(user.total_co2, 6),
+        "total_co2": round(total, 6),
         "log": log.to_dict(),
     }
     return jsonify(response_payload)
 
 
+@app.route("/chat/bulk", methods=["POST"])
+@limiter.limit("chat_bulk")
+def chat_bulk():
+    """
+    Log many prompts at once, e.g. entries queued offline by a client.
+    Body: {"prompts": [...], "idempotency_key": "..."} (the key may also be
+    sent as an Idempotency-Key header). Everything is written in one commit.
+    """
+    data = request.get_json() or {}
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+        return jsonify({"ok": False, "error": "prompts must be a list of strings"}), 400
+    prompts = [p.strip() for p in prompts if p.strip()]
+
+    user = session_user()
+    calcs = calculate_many(prompts)
+    rows = [
+        {
+            "activity": prompt,
+            "category": calc["category"],
+            "quantity": calc["quantity"],
+            "unit": calc["unit"],
+            "co2": calc["co2"],
+            "factor_version": calc["factor_version"],
+        }
+        for prompt, calc in zip(prompts, calcs)
+    ]
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    saved = []
+
+    def derived_writes(inserted):
+        add_to_rollups(db, CO2Rollup, log_events(inserted))
+        saved.extend(inserted)
+
+    user_directory.ensure(user)
+    result = bulk_ingest(
+        db, CarbonLog, counter, user.id, rows, IngestKey, key,
+        before_commit=derived_writes, ensure_user=lambda: user_directory.recreate(user),
+    )
+    if not result["replayed"]:
+        user_directory.written(user.id, result["total_co2"])
+        leaderboard_index.set_total(user.id, result["total_co2"])
+        user_written(user.id)
+        publish_write(user.id, result["total_co2"], [CarbonLog(**r).to_dict() for r in saved])
+
+    return jsonify(
+        {
+            "ok": True,
+            **result,
+            "results": [{"message": c["message"], "co2": c["co2"]} for c in calcs],
+            "total_co2": round(result["total_co2"], 6),
+        }
+    )
+
+
 @app.route("/history", methods=["GET"])
+@responses.cached(scope="user", user_id=session_user_id)
 def history():
-    user = get_or_create_session_user()
-    logs = CarbonLog.query.filter_by(user_id=user.id).order_by(CarbonLog.created_at.desc()).limit(50).all()
-    return jsonify([l.to_dict() for l in logs])
+    user = session_user()
+    wait_for_own_writes(user)
+    try:
+        limit, before, after = parse_page_args(request.args)
+        logs, next_cursor = keyset_page(CarbonLog.query.filter_by(user_id=user.id), CarbonLog, limit, before, after)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"items": [l.to_dict() for l in logs], "next_cursor": next_cursor})
+
+
+@app.route("/events", methods=["GET"])
+def events():
+    """
+    The session user's live stream. On connect: "stats" (as /stats) and
+    "history" (as /history?limit=20); then "total" ({"total_co2"}) and
+    "log" (a list of new logs) as the user writes. With ?leaderboard=1 the
+    "leaderboard" events of /leaderboard/stream come on the same connection.
+    """
+    user = session_user()
+    wait_for_own_writes(user)
+    topics = [f"user:{user.id}"]
+    if request.args.get("leaderboard"):
+        topics.append("leaderboard")
+
+    def first_frames():
+        logs, next_cursor = keyset_page(CarbonLog.query.filter_by(user_id=user.id), CarbonLog, 20)
+        frames = [
+            sse("stats", user_payload(user)),
+            sse("history", {"items": [l.to_dict() for l in logs], "next_cursor": next_cursor}),
+        ]
+        if "leaderboard" in topics:
+            frames.append(sse("leaderboard", broker.current("leaderboard")))
+        return frames
+
+    return live_stream(topics, first_frames)
+
+
+@app.route("/export", methods=["GET"])
+def export():
+    """
+    Full history as a streamed download: ?format=ndjson|csv, optional
+    ?since= / ?until= ISO dates. Gzipped when the client accepts it.
+    """
+    user = session_user()
+    wait_for_own_writes(user)
+    try:
+        fmt, since, until = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    query = filter_range(CarbonLog.query.filter_by(user_id=user.id), CarbonLog, since, until)
+    query = query.order_by(CarbonLog.created_at.asc(), CarbonLog.id.asc())
+    fields = ["id", "created_at", "activity", "category", "quantity", "unit", "co2"]
+    return stream_export(query, fields, fmt, "carbon-history", gzip="gzip" in request.accept_encodings)
 
 
 @app.route("/stats", methods=["GET"])
+@responses.cached(scope="user", user_id=session_user_id)
 def stats():
-    user = get_or_create_session_user()
-    return jsonify(user.to_dict())
+    user = session_user()
+    wait_for_own_writes(user)
+    return jsonify(user_payload(user))
+
+
+@app.route("/stats/summary", methods=["GET"])
+@responses.cached(scope="user", ttl=app.config["STATS_CACHE_TTL"], user_id=session_user_id)
+def stats_summary():
+    """
+    Per-category totals, a daily series for the last ?days= (default 30)
+    and saved vs emitted splits, all read from co2_rollups so the cost does
+    not grow with the number of logs. Cached per user for STATS_CACHE_TTL.
+    """
+    user = session_user()
+    wait_for_own_writes(user)
+    days = max(1, min(request.args.get("days", 30, type=int), 366))
+    return jsonify(build_summary(user, days, datetime.utcnow().date()))
+
+
+def build_summary(user, days, today):
+    def split(row):
+        return {
+            "co2": round(row.co2, 4),
+            "saved": round(row.saved, 4),
+            "emitted": round(row.emitted, 4),
+            "entries": row.entries,
+        }
+
+    all_time = CO2Rollup.query.filter_by(user_id=user.id, period="all").all()
+    totals = next((r for r in all_time if r.category == ALL_CATEGORIES), None)
+    categories = sorted(
+        ({"category": r.category, **split(r)} for r in all_time if r.category != ALL_CATEGORIES),
+        key=lambda c: c["co2"],
+    )
+
+    first_day = today - timedelta(days=days - 1)
+    by_day = {
+        r.period_start: r
+        for r in CO2Rollup.query.filter(
+            CO2Rollup.user_id == user.id,
+            CO2Rollup.period == "day",
+            CO2Rollup.category == ALL_CATEGORIES,
+            CO2Rollup.period_start >= first_day,
+        )
+    }
+    empty = {"co2": 0.0, "saved": 0.0, "emitted": 0.0, "entries": 0}
+    daily = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        daily.append({"date": day.isoformat(), **(split(by_day[day]) if day in by_day else empty)})
+
+    return {
+        "user": user_payload(user),
+        "totals": split(totals) if totals else empty,
+        "categories": categories,
+        "daily": daily,
+    }
 
 
 @app.route("/leaderboard", methods=["GET"])
+@responses.cached(scope="global")
 def leaderboard():
     # return top users sorted by total_co2 (highest saved on top)
     # note: total_co2 can have negative values (net emissions), positive is net saved
-    users = User.query.order_by(User.total_co2.desc()).limit(20).all()
-    return jsonify([u.to_dict() for u in users])
+    if "window" in request.args or "category" in request.args:
+        return window_leaderboard()
+    return jsonify(ranked_users(leaderboard_index.top(20)))
+
+
+def window_leaderboard():
+    """
+    /leaderboard?window=day|week|month|all&category=&date=YYYY-MM-DD&limit=&offset=
+    served straight from the co2_rollups board index.
+    """
+    try:
+        period, start, category = parse_window_args(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    offset = max(0, request.args.get("offset", 0, type=int))
+
+    entries = top_users(db, CO2Rollup, period, start, category, limit, offset)
+    users = {u.id: u for u in User.query.filter(User.id.in_([uid for _, uid, _, _ in entries]))}
+    return jsonify(
+        {
+            "window": period,
+            "period_start": start.isoformat(),
+            "category": category,
+            "items": [
+                {**users[uid].to_dict(), "rank": rank, "co2": round(co2, 4), "entries": n}
+                for rank, uid, co2, n in entries
+                if uid in users
+            ],
+        }
+    )
+
+
+@app.route("/leaderboard/me", methods=["GET"])
+@responses.cached(scope="user", user_id=session_user_id)
+def leaderboard_me():
+    """
+    The caller's rank plus the users just above and below (?radius=, default 5).
+    """
+    user = session_user()
+    wait_for_own_writes(user)
+    radius = max(0, min(request.args.get("radius", 5, type=int), 50))
+    return jsonify(
+        {
+            "rank": leaderboard_index.rank(user.id),
+            "total_users": len(leaderboard_index),
+            "around": ranked_users(leaderboard_index.around(user.id, radius)),
+        }
+    )
+
+
+@app.route("/leaderboard/stream", methods=["GET"])
+def leaderboard_stream():
+    """/leaderboard as a stream: a "leaderboard" event now and whenever the top 20 changes."""
+    return live_stream(["leaderboard"], lambda: [sse("leaderboard", broker.current("leaderboard"))])
+
+
+def ranked_users(entries):
+    # entries are (rank, user_id, total) from the index; names etc. come from one PK lookup
+    users = {u.id: u for u in User.query.filter(User.id.in_([uid for _, uid, _ in entries]))}
+    ranked = []
+    for rank, uid, total in entries:
+        if uid in users:
+            ranked.append({**users[uid].to_dict(), "total_co2": round(total, 4), "rank": rank})
+    return ranked
+
+
+@app.route("/metrics/ingest", methods=["GET"])
+def ingest_metrics():
+    queue = get_write_queue()
+    if queue is None:
+        return jsonify({"write_behind": False})
+    return jsonify({"write_behind": True, **queue.metrics()})
+
+
+def rebuild_rollups():
+    return backfill(
+        db,
+        CarbonLog,
+        CO2Rollup,
+        lambda l: [(l.user_id, l.created_at or datetime.utcnow(), l.category, l.co2)],
+    )
+
+
+@app.cli.command("backfill-rollups")
+def backfill_rollups_command():
+    """Rebuild co2_rollups from carbon_logs (run with writers stopped)."""
+    done = rebuild_rollups()
+    print(f"✅ rolled up {done} logs")
+
+
+@app.cli.command("recompute")
+@click.option("--batch-size", default=2000, show_default=True)
+@click.option("--checkpoint", default="recompute-carbon_logs.json", show_default=True)
+@click.option("--all", "everything", is_flag=True, help="Also re-score rows already on the current factor version.")
+def recompute_command(batch_size, checkpoint, everything):
+    """Re-score carbon_logs with the current emission factors (run with writers stopped)."""
+    table = factors.reload()
+
+    def score_batch(rows):
+        categories, co2s = rescore([r.activity for r in rows], [r.quantity for r in rows], table)
+        return [
+            {"id": r.id, "category": category, "co2": co2, "factor_version": table.version}
+            for r, category, co2 in zip(rows, categories, co2s)
+        ]
+
+    print(f"re-scoring carbon_logs with factors {table.version}")
+    result = recompute(
+        db, CarbonLog, User, ["activity", "quantity"], score_batch, table.version,
+        batch_size=batch_size, checkpoint=checkpoint, everything=everything, rebuild=counter.rebuild,
+    )
+    rebuild_rollups()
+    print(f"✅ re-scored {result['rows']} logs in {result['seconds']:.1f}s ({result['rows_per_sec']:.0f} rows/s)")
+
+
+@app.cli.command("reconcile-totals")
+@click.option("--fix", is_flag=True, help="Rebuild users.total_co2 from the logs when they disagree.")
+def reconcile_totals_command(fix):
+    """Check users.total_co2 (plus sharded counters) against SUM(co2) of carbon_logs."""
+    counter.fold()
+    drifted = counter.reconcile(fix=fix)
+    for uid, stored, actual in drifted[:20]:
+        print(f"❌ {uid}: total_co2 {stored:.6f}, logs sum to {actual:.6f}")
+    if not drifted:
+        print("✅ every total matches its logs")
+    elif fix:
+        print(f"✅ rebuilt totals ({len(drifted)} users had drifted)")
+    else:
+        raise SystemExit(1)
 
 
 # ---------------------------
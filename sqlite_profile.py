@@ -0,0 +1,121 @@
+"""
+SQLite storage profile shared by app.py and server.py.
+
+Every pooled connection gets the same pragmas (WAL journal, synchronous
+NORMAL, busy timeout, bigger page cache, mmap, in-memory temp store) so
+several gunicorn workers can read while one writes instead of failing with
+"database is locked".
+
+Usage, before `SQLAlchemy(app)`:
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_engine_options(app.config)
+
+and inside an app context, before the first query:
+
+    apply_sqlite_profile(app, db)
+
+Override any pragma with app.config["SQLITE_PRAGMAS"] and the pool with
+app.config["SQLITE_POOL"].
+"""
+from sqlalchemy import event
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ms to wait on a locked database before erroring
+    "cache_size": -64000,  # negative = KiB, so ~64 MB of page cache
+    "mmap_size": 268435456,  # 256 MB
+    "temp_store": "MEMORY",
+}
+
+DEFAULT_POOL = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_pre_ping": True,
+}
+
+# what SQLite reports back for the enum-like pragmas
+_READBACK_NAMES = {
+    "synchronous": {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"},
+    "temp_store": {0: "DEFAULT", 1: "FILE", 2: "MEMORY"},
+}
+
+
+def _pragmas(config):
+    return {**DEFAULT_PRAGMAS, **(config.get("SQLITE_PRAGMAS") or {})}
+
+
+def _is_memory(uri):
+    return uri in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in uri
+
+
+def sqlite_engine_options(config):
+    """
+    Engine options for SQLALCHEMY_ENGINE_OPTIONS: the pool settings plus
+    sqlite3 connect args (Python-level lock timeout matching busy_timeout,
+    and connections that may be handed between threads by the pool).
+    """
+    uri = config.get("SQLALCHEMY_DATABASE_URI", "")
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if not uri.startswith("sqlite") or _is_memory(uri):
+        return options
+
+    busy_ms = _pragmas(config)["busy_timeout"]
+    options.update({**DEFAULT_POOL, **(config.get("SQLITE_POOL") or {})})
+    options.setdefault("connect_args", {}).update(
+        {"timeout": busy_ms / 1000, "check_same_thread": False}
+    )
+    return options
+
+
+def read_pragmas(connection, names):
+    active = {}
+    for name in names:
+        value = connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        active[name] = _READBACK_NAMES.get(name, {}).get(value, value)
+    return active
+
+
+def install_pragmas(engine, config):
+    """
+    Set the profile's pragmas on every new DBAPI connection of `engine`
+    (for an AsyncEngine pass engine.sync_engine). Returns the pragmas.
+    """
+    pragmas = _pragmas(config)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return pragmas
+
+
+def apply_sqlite_profile(app, db):
+    """
+    Install the pragmas on every new connection of `db.engine` and log what
+    the database actually reports back, warning about any pragma SQLite
+    refused (e.g. WAL on a filesystem without shared memory).
+    Returns the active pragma values.
+    """
+    engine = db.engine
+    if engine.dialect.name != "sqlite" or _is_memory(str(engine.url)):
+        return {}
+
+    pragmas = install_pragmas(engine, app.config)
+
+    with engine.connect() as connection:
+        active = read_pragmas(connection, pragmas)
+
+    for name, wanted in pragmas.items():
+        if str(active[name]).upper() != str(wanted).upper():
+            app.logger.warning("sqlite pragma %s=%s requested but database reports %s", name, wanted, active[name])
+    app.logger.info(
+        "sqlite profile for %s: %s",
+        engine.url.database,
+        ", ".join(f"{k}={v}" for k, v in active.items()),
+    )
+    return active
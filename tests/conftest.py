@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+import importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py and server.py open their database on import: keep the tests off instance/carbon.db
+os.environ.setdefault("CARBON_DATABASE_URI", f"sqlite:///{tempfile.mkdtemp(prefix='carbon-tests-')}/carbon.db")
+
+
+@pytest.fixture(scope="session")
+def parsers():
+    """benchmarks/parsers.py: the corpus, golden.json and the engine check live there."""
+    spec = importlib.util.spec_from_file_location("parsers", os.path.join(ROOT, "benchmarks", "parsers.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,13 @@
+"""The calculators' outputs must match benchmarks/golden.json (see benchmarks/parsers.py)."""
+import factors
+
+
+def test_golden_was_made_with_the_current_factors(parsers):
+    golden = parsers.load_json(parsers.GOLDEN_PATH)
+    assert golden is not None, "no golden.json: run benchmarks/parsers.py --update-golden"
+    assert golden["factor_version"] == factors.current().version
+
+
+def test_outputs_match_golden(parsers):
+    golden = parsers.load_json(parsers.GOLDEN_PATH)
+    assert parsers.check_golden(parsers.calculators(), golden) == []
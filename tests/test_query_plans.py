@@ -0,0 +1,39 @@
+"""
+The hot read queries must be answered from their indexes: migrate a
+scratch database with both apps' schemas and run EXPLAIN QUERY PLAN over
+migrations.QUERY_PLANS (the statements the endpoints build).
+"""
+import pytest
+from sqlalchemy import create_engine
+
+import migrations
+
+
+@pytest.fixture
+def connection(tmp_path):
+    import app
+    import server
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    server.db.metadata.create_all(engine)
+    app.db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        migrations.migrate(conn)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def test_every_checked_table_exists(connection):
+    tables = {name for _, name, _, _ in migrations.QUERY_PLANS}
+    assert all(migrations.table_columns(connection, name) for name in tables)
+
+
+def test_hot_queries_use_their_indexes(connection):
+    assert migrations.check_query_plans(connection) == []
+
+
+def test_check_reports_a_missing_index(connection):
+    connection.exec_driver_sql("DROP INDEX ix_carbon_log_user_created")
+    problems = migrations.check_query_plans(connection)
+    assert problems and all("ix_carbon_log_user_created" in p for p in problems)
@@ -0,0 +1,29 @@
+"""scoring.py's vectorized engine must give exactly what app.compute_item gives."""
+import math
+
+import pytest
+
+pytest.importorskip("numpy")
+
+
+def outcome(value, explain):
+    # == alone would let 0.0 / -0.0 and 2 / 2.0 through
+    return type(value), math.copysign(1, value), value, explain
+
+
+def test_engine_matches_compute_item_on_the_golden_inputs(parsers):
+    checked, problems = parsers.check_scoring(parsers.make_corpus(200, seed=7))
+    assert checked > 200
+    assert problems == []
+
+
+@pytest.mark.parametrize("quantity", [0, 0.0, 2, 1.5])
+@pytest.mark.parametrize("quantity_kg", [None, 0, 0.0, 0.3])
+@pytest.mark.parametrize("unit", ["km", "kwh", "g", ""])
+@pytest.mark.parametrize("activity", ["car", "walk", "electricity", "beef", "no such thing"])
+def test_zero_and_int_results_keep_the_reference_sign_and_type(activity, unit, quantity, quantity_kg):
+    import app
+
+    item = {"activity": activity, "quantity": quantity, "unit": unit, "quantity_kg": quantity_kg}
+    batch = app.scoring.get_engine().batch([item])
+    assert outcome(batch.values()[0], batch.explain(0)) == outcome(*app.compute_item(item))
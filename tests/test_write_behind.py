@@ -0,0 +1,36 @@
+"""
+A write-behind flush commits its rows before the in-process follow-ups
+(leaderboard index, user directory, cache invalidation); a failure in
+those must not make the queue retry rows that are already written.
+"""
+import uuid
+from datetime import datetime
+
+import pytest
+
+
+def test_post_commit_failure_does_not_fail_the_flush(monkeypatch):
+    import server
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(server.leaderboard_index, "apply_delta", broken)
+    monkeypatch.setattr(server.broker, "touch", broken)
+
+    user_id = str(uuid.uuid4())
+    row = {
+        "user_id": user_id,
+        "activity": "walked 2 km",
+        "category": "transport",
+        "quantity": 2.0,
+        "unit": "km",
+        "co2": 0.5,
+        "factor_version": "test",
+        "created_at": datetime.utcnow(),
+    }
+    server.write_log_batch([(user_id, row, 0.5)])
+
+    with server.app.app_context():
+        assert server.CarbonLog.query.filter_by(user_id=user_id).count() == 1
+        assert server.db.session.get(server.User, user_id).total_co2 == pytest.approx(0.5)
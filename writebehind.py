@@ -0,0 +1,214 @@
+"""
+Write-behind queue with group commit.
+
+Request handlers `submit` rows instead of committing them; a single
+background thread hands them to `flush_fn` in batches, either when
+`batch_size` rows are waiting or `interval` seconds after the oldest one
+arrived. The queue is bounded: `submit` returns False when it is full so
+the caller can answer 429.
+
+Readers that must see their own writes call `wait_for(user_id)`, which
+forces a flush and blocks until none of that user's rows are pending.
+
+A failing batch is retried `max_retries` times with backoff. If it still
+fails, it is written in halves until the rows that fail on their own are
+found; those are logged, dropped into a bounded dead-letter list and
+counted in metrics(), so one bad row cannot stall the writer (and fill
+the queue) for good.
+"""
+import time
+import logging
+import threading
+from collections import deque
+
+
+class WriteBehindQueue:
+    def __init__(self, flush_fn, max_size=10000, batch_size=500, interval=0.05, logger=None,
+                 max_retries=3, dead_letter_size=1000):
+        """
+        flush_fn(batch) must persist a list of (user_id, row, co2_delta)
+        tuples in one transaction, or raise (and write nothing) to have
+        the batch retried.
+        """
+        self.flush_fn = flush_fn
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._items = deque()
+        self._pending = {}  # user_id -> [rows, co2 delta] not yet committed
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._flush_requested = False
+
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._failures = 0
+        self._rejected = 0
+        self._dead_letters = deque(maxlen=dead_letter_size)  # the most recent dropped rows
+        self._dropped = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    # ---------------------------
+    # producer side
+    # ---------------------------
+    def submit(self, user_id, row, co2_delta):
+        with self._cond:
+            if self._stopping or len(self._items) >= self.max_size:
+                self._rejected += 1
+                return False
+            self._items.append((user_id, row, co2_delta))
+            pending = self._pending.setdefault(user_id, [0, 0.0])
+            pending[0] += 1
+            pending[1] += co2_delta
+            self._ensure_started()
+            self._cond.notify_all()
+        return True
+
+    def pending_delta(self, user_id):
+        with self._cond:
+            pending = self._pending.get(user_id)
+            return pending[1] if pending else 0.0
+
+    def wait_for(self, user_id, timeout=5.0):
+        """
+        Flush now and wait until the user's queued rows are committed.
+        Returns False if they are still pending after `timeout` seconds.
+        """
+        with self._cond:
+            if user_id not in self._pending:
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: user_id not in self._pending, timeout)
+
+    def stop(self, timeout=10.0):
+        """Stop accepting rows, drain what is queued and join the writer."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._items),
+                "max_queue": self.max_size,
+                "pending_users": len(self._pending),
+                "flushes": self._flushes,
+                "flushed_rows": self._flushed_rows,
+                "failed_flushes": self._failures,
+                "rejected": self._rejected,
+                "dead_letters": self._dropped,
+                "last_flush_ms": round(self._last_flush_ms, 3),
+                "max_flush_ms": round(self._max_flush_ms, 3),
+                "avg_flush_ms": round(self._total_flush_ms / self._flushes, 3) if self._flushes else 0.0,
+            }
+
+    def dead_letters(self):
+        """The most recent (user_id, row, co2_delta) tuples dropped as unwritable."""
+        with self._cond:
+            return list(self._dead_letters)
+
+    # ---------------------------
+    # writer side
+    # ---------------------------
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = None
+            while not (self._stopping or self._flush_requested or len(self._items) >= self.batch_size):
+                if not self._items:
+                    deadline = None
+                    self._cond.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(self.batch_size, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+            if not self._items:
+                self._flush_requested = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            self._write(batch)
+
+    def _try_flush(self, batch):
+        try:
+            self.flush_fn(batch)
+            return True
+        except Exception:
+            self.logger.exception("write-behind flush of %d rows failed", len(batch))
+            with self._cond:
+                self._failures += 1
+            return False
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        written = len(batch)
+        for attempt in range(self.max_retries + 1):
+            if self._try_flush(batch):
+                break
+            if attempt < self.max_retries:
+                time.sleep(self.interval * 2 ** attempt)
+        else:
+            written = self._isolate(batch)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._cond:
+            # written or dropped, none of these rows is pending any more
+            for user_id, _, co2_delta in batch:
+                pending = self._pending[user_id]
+                pending[0] -= 1
+                pending[1] -= co2_delta
+                if pending[0] == 0:
+                    del self._pending[user_id]
+            self._flushes += 1
+            self._flushed_rows += written
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            self._cond.notify_all()
+
+    def _isolate(self, batch):
+        """
+        Write a batch that keeps failing in halves, dropping the rows that
+        fail alone. Returns how many rows were written.
+        """
+        if len(batch) == 1:
+            user_id, row, _ = batch[0]
+            self.logger.error("write-behind dropped a row for user %s that cannot be written: %r", user_id, row)
+            with self._cond:
+                self._dead_letters.append(batch[0])
+                self._dropped += 1
+            return 0
+        written = 0
+        mid = len(batch) // 2
+        for half in (batch[:mid], batch[mid:]):
+            if self._try_flush(half):
+                written += len(half)
+            else:
+                written += self._isolate(half)
+        return written